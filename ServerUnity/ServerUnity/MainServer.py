@@ -1,58 +1,622 @@
 import os
-from flask import Flask, request, jsonify
+import argparse
+import base64
+import heapq
+import json
+import math
+import re
+import sys
+import threading
+import time
+import zlib
+from contextlib import ExitStack
+from itertools import islice
+from flask import Flask, Response, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
 import sqlite3
-import bcrypt
 import jwt
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import metrics
+from archive import Archiver, archive_batch
+from caches import TTLCache
+from compression import COMPRESSIBLE_MIMETYPES, compress, compress_stream, negotiate
+from changefeed import ChangeFeed, fetch_changes, latest_seq, oldest_seq
+from db_pool import ConnectionPool, open_connection
+from hashing import HasherBusy, PasswordHasher
+from maintenance import WalMaintenance, list_snapshots, prune_snapshots, snapshot, wal_size
+from migrations import LATEST_VERSION, current_version, migrate
+from ratelimit import ConcurrencyLimit, MemoryBackend, SQLiteBackend, TokenBucket
+from shards import (decode_position, encode_position, later_position, merge_rows, next_request_id,
+                    rebalance, shard_of, shard_path)
+from write_queue import WriteQueue
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = '555'
+app.config['DATABASE'] = os.environ.get('DATABASE', 'users.db')
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 16))
+app.config['DB_TIMEOUT'] = float(os.environ.get('DB_TIMEOUT', 30))
+app.config['DB_HEALTH_CHECK_INTERVAL'] = float(os.environ.get('DB_HEALTH_CHECK_INTERVAL', 60))
+app.config['DB_READ_POOL_SIZE'] = int(os.environ.get('DB_READ_POOL_SIZE', 32))
+app.config['DB_READ_CACHE_SIZE_KB'] = int(os.environ.get('DB_READ_CACHE_SIZE_KB', 16384))
+app.config['DB_MMAP_SIZE'] = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['DB_WARM_CONNECTIONS'] = int(os.environ.get('DB_WARM_CONNECTIONS', 4))
+app.config['SHARD_COUNT'] = max(1, int(os.environ.get('SHARD_COUNT', 1)))
+app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', 4096))
+app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 300))
+app.config['TOKEN_CACHE_SIZE'] = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+app.config['BCRYPT_ROUNDS'] = int(os.environ.get('BCRYPT_ROUNDS', 12))
+app.config['BCRYPT_WORKERS'] = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 2))
+app.config['BCRYPT_MAX_PENDING'] = int(os.environ.get('BCRYPT_MAX_PENDING', 32))
+app.config['BCRYPT_RETRY_AFTER'] = int(os.environ.get('BCRYPT_RETRY_AFTER', 2))
+app.config['PAGE_MAX_LIMIT'] = int(os.environ.get('PAGE_MAX_LIMIT', 500))
+app.config['STREAM_BATCH_SIZE'] = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+app.config['CHANGES_MAX_WAIT'] = float(os.environ.get('CHANGES_MAX_WAIT', 30))
+app.config['BULK_MAX_ITEMS'] = int(os.environ.get('BULK_MAX_ITEMS', 1000))
+app.config['SEARCH_DEFAULT_LIMIT'] = int(os.environ.get('SEARCH_DEFAULT_LIMIT', 20))
+app.config['SEARCH_MAX_TERMS'] = int(os.environ.get('SEARCH_MAX_TERMS', 16))
+app.config['CHANGES_POLL_INTERVAL'] = float(os.environ.get('CHANGES_POLL_INTERVAL', 2))
+app.config['CHANGES_STREAM_HEARTBEAT'] = float(os.environ.get('CHANGES_STREAM_HEARTBEAT', 15))
+app.config['CHANGES_STREAM_MAX_AGE'] = float(os.environ.get('CHANGES_STREAM_MAX_AGE', 300))
+app.config['WRITE_BATCH_MAX'] = int(os.environ.get('WRITE_BATCH_MAX', 64))
+app.config['WRITE_BATCH_DELAY'] = float(os.environ.get('WRITE_BATCH_DELAY', 0.002))
+app.config['WRITE_TIMEOUT'] = float(os.environ.get('WRITE_TIMEOUT', 30))
+app.config['ASGI_WSGI_THREADS'] = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+app.config['ASGI_DB_THREADS'] = int(os.environ.get('ASGI_DB_THREADS', 8))
+app.config['JSON_PROVIDER'] = os.environ.get('JSON_PROVIDER', 'auto')  # auto | stdlib
+app.config['COMPRESSION_ENABLED'] = os.environ.get('COMPRESSION_ENABLED', '1') == '1'
+app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+app.config['COMPRESSION_GZIP_LEVEL'] = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+app.config['COMPRESSION_BR_QUALITY'] = int(os.environ.get('COMPRESSION_BR_QUALITY', 5))
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory | sqlite
+app.config['RATE_LIMIT_DATABASE'] = os.environ.get('RATE_LIMIT_DATABASE', 'ratelimit.db')
+app.config['RATE_LIMIT_IP_RATE'] = float(os.environ.get('RATE_LIMIT_IP_RATE', 2))
+app.config['RATE_LIMIT_IP_BURST'] = float(os.environ.get('RATE_LIMIT_IP_BURST', 30))
+app.config['RATE_LIMIT_USER_RATE'] = float(os.environ.get('RATE_LIMIT_USER_RATE', 0.2))
+app.config['RATE_LIMIT_USER_BURST'] = float(os.environ.get('RATE_LIMIT_USER_BURST', 10))
+# Число доверенных прокси перед сервером (0 — X-Forwarded-For не учитывается);
+# прежний RATE_LIMIT_TRUST_PROXY=1 означает один прокси
+app.config['RATE_LIMIT_PROXY_HOPS'] = int(os.environ.get('RATE_LIMIT_PROXY_HOPS',
+                                                         os.environ.get('RATE_LIMIT_TRUST_PROXY', 0)))
+app.config['ARCHIVE_ENABLED'] = os.environ.get('ARCHIVE_ENABLED', '1') == '1'
+app.config['ARCHIVE_STATUSES'] = os.environ.get('ARCHIVE_STATUSES', 'Completed,Rejected').split(',')
+app.config['ARCHIVE_MIN_AGE_DAYS'] = float(os.environ.get('ARCHIVE_MIN_AGE_DAYS', 30))
+app.config['ARCHIVE_BATCH_SIZE'] = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+app.config['ARCHIVE_INTERVAL'] = float(os.environ.get('ARCHIVE_INTERVAL', 60))
+app.config['WAL_CHECKPOINT_ENABLED'] = os.environ.get('WAL_CHECKPOINT_ENABLED', '1') == '1'
+app.config['WAL_CHECKPOINT_INTERVAL'] = float(os.environ.get('WAL_CHECKPOINT_INTERVAL', 30))
+app.config['WAL_CHECKPOINT_QUIET'] = float(os.environ.get('WAL_CHECKPOINT_QUIET', 60))
+app.config['WAL_CHECKPOINT_BUSY_TIMEOUT'] = float(os.environ.get('WAL_CHECKPOINT_BUSY_TIMEOUT', 1))
+app.config['SNAPSHOT_DIR'] = os.environ.get('SNAPSHOT_DIR', 'snapshots')
+app.config['SNAPSHOT_INTERVAL'] = float(os.environ.get('SNAPSHOT_INTERVAL', 0))
+app.config['SNAPSHOT_KEEP'] = int(os.environ.get('SNAPSHOT_KEEP', 7))
+app.config['AUTH_MAX_CONCURRENCY'] = int(os.environ.get('AUTH_MAX_CONCURRENCY', app.config['BCRYPT_MAX_PENDING']))
+
+# Кэш личности пользователя: username -> (id, is_partner)
+identity_cache = TTLCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+# Успешно проверенные JWT: token -> payload (живут до exp токена)
+token_cache = TTLCache(app.config['TOKEN_CACHE_SIZE'], 24 * 60 * 60)
+# bcrypt выполняется в отдельном ограниченном пуле, а не в потоке запроса
+password_hasher = PasswordHasher(
+    workers=app.config['BCRYPT_WORKERS'],
+    max_pending=app.config['BCRYPT_MAX_PENDING'],
+    rounds=app.config['BCRYPT_ROUNDS']
+)
+# Пробуждение клиентов, ждущих изменений заявок
+change_feed = ChangeFeed(poll_interval=app.config['CHANGES_POLL_INTERVAL'])
+# Лимиты для /api/login и /api/register: частота по IP и по имени, число одновременных
+if app.config['RATE_LIMIT_BACKEND'] == 'sqlite':
+    rate_limit_backend = SQLiteBackend(app.config['RATE_LIMIT_DATABASE'])
+else:
+    rate_limit_backend = MemoryBackend()
+ip_limit = TokenBucket(rate_limit_backend, app.config['RATE_LIMIT_IP_RATE'],
+                       app.config['RATE_LIMIT_IP_BURST'], prefix='ip:')
+user_limit = TokenBucket(rate_limit_backend, app.config['RATE_LIMIT_USER_RATE'],
+                         app.config['RATE_LIMIT_USER_BURST'], prefix='user:')
+auth_concurrency = ConcurrencyLimit(app.config['AUTH_MAX_CONCURRENCY'])
+
+
+def _write_committed(operations):
+    metrics.registry.inc('write_queue_batches_total')
+    metrics.registry.inc('write_queue_operations_total', operations)
+    # Любая запись сервера (заявки, пользователи, архив) откладывает TRUNCATE
+    wal_maintenance.touch()
+    change_feed.notify()
+
+def _make_writer(index):
+    path = shard_path(app.config['DATABASE'], index)
+    return WriteQueue(
+        lambda: open_connection(path, app.config['DB_TIMEOUT'], metrics.TimedConnection),
+        max_batch=app.config['WRITE_BATCH_MAX'],
+        max_delay=app.config['WRITE_BATCH_DELAY'],
+        on_commit=_write_committed
+    )
+
+# Создание и изменение заявок идут через поток-писатель с групповым коммитом
+# (по одному на файл базы; write_queue — писатель основной базы, шарда 0)
+write_queue = _make_writer(0)
+_writers = {0: write_queue}
+_writers_lock = threading.Lock()
+
+
+def _archive_next_batch():
+    moved = sum(
+        get_writer(index).execute(
+            archive_batch,
+            app.config['ARCHIVE_STATUSES'],
+            app.config['ARCHIVE_MIN_AGE_DAYS'] * 24 * 60 * 60,
+            app.config['ARCHIVE_BATCH_SIZE'],
+            timeout=app.config['WRITE_TIMEOUT']
+        )
+        for index in range(app.config['SHARD_COUNT'])
+    )
+    metrics.registry.inc('archived_requests_total', moved)
+    return moved
+
+def _archive_failed(error):
+    print(f'Ошибка архивации заявок: {error}', file=sys.stderr)
+
+# Перенос завершенных заявок в архив небольшими пачками через поток-писатель
+archiver = Archiver(
+    _archive_next_batch,
+    batch_size=app.config['ARCHIVE_BATCH_SIZE'],
+    interval=app.config['ARCHIVE_INTERVAL'],
+    on_error=_archive_failed
+)
+
+
+def database_files():
+    """Файлы базы: основная и шарды"""
+    return [shard_path(app.config['DATABASE'], index) for index in range(app.config['SHARD_COUNT'])]
+
+_snapshot_lock = threading.Lock()
+
+def take_snapshots():
+    """
+    Онлайн-снимки всех файлов базы в SNAPSHOT_DIR; старые сверх SNAPSHOT_KEEP удаляются.
+    Каждый файл согласован сам по себе, но снимки шардов сделаны не в один момент
+    """
+    with _snapshot_lock:
+        paths = []
+        for path in database_files():
+            paths.append(snapshot(path, app.config['SNAPSHOT_DIR'], app.config['DB_TIMEOUT']))
+            prune_snapshots(path, app.config['SNAPSHOT_DIR'], app.config['SNAPSHOT_KEEP'])
+    metrics.registry.inc('db_snapshots_total')
+    return paths
+
+def _scheduled_snapshot():
+    # Под gunicorn поток обслуживания есть в каждом процессе:
+    # снимок пропускается, если другой процесс недавно его сделал
+    existing = list_snapshots(app.config['DATABASE'], app.config['SNAPSHOT_DIR'])
+    if existing and time.time() - os.path.getmtime(existing[-1]) < app.config['SNAPSHOT_INTERVAL'] / 2:
+        return None
+    return take_snapshots()
+
+def _checkpoint_done(mode, result):
+    metrics.registry.inc('wal_checkpoints_total', mode=mode.lower(), result=result)
+
+def _maintenance_failed(error):
+    print(f'Ошибка обслуживания базы: {error}', file=sys.stderr)
+
+# Контрольные точки WAL всех файлов базы (и снимки по расписанию SNAPSHOT_INTERVAL)
+wal_maintenance = WalMaintenance(
+    database_files(),
+    interval=app.config['WAL_CHECKPOINT_INTERVAL'],
+    quiet_after=app.config['WAL_CHECKPOINT_QUIET'],
+    busy_timeout=app.config['WAL_CHECKPOINT_BUSY_TIMEOUT'],
+    checkpoints=app.config['WAL_CHECKPOINT_ENABLED'],
+    snapshot_interval=app.config['SNAPSHOT_INTERVAL'],
+    run_snapshot=_scheduled_snapshot,
+    on_checkpoint=_checkpoint_done,
+    on_error=_maintenance_failed
+)
+
+
+# ======================
+# Метрики
+# ======================
+
+class InstrumentedJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер, учитывающий время сериализации в метриках"""
 
+    def dumps(self, obj, **kwargs):
+        with metrics.timer('serialize'):
+            return super().dumps(obj, **kwargs)
+
+class FastJSONProvider(InstrumentedJSONProvider):
+    """
+    Сериализация через orjson. Результат — тот же JSON (даты через
+    default провайдера Flask), но без экранирования кириллицы и в несколько
+    раз быстрее. Параметры dumps, которых orjson не знает, уходят в stdlib
+    """
+
+    def _options(self, kwargs):
+        """Флаги orjson для параметров dumps или None, если нужен stdlib"""
+        kwargs = dict(kwargs)
+        indent = kwargs.pop('indent', None)
+        kwargs.pop('separators', None)
+        if kwargs or indent not in (None, 2):
+            return None
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        option = self._options(kwargs)
+        if option is None:
+            return super().dumps(obj, **kwargs)
+        with metrics.timer('serialize'):
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        """Как DefaultJSONProvider.response, но bytes от orjson идут в ответ без перекодирования"""
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        with metrics.timer('serialize'):
+            data = orjson.dumps(obj, default=self.default, option=self._options({'indent': 2 if pretty else None}))
+        return self._app.response_class(data + b'\n', mimetype=self.mimetype)
+
+# JSON_PROVIDER=stdlib — стандартный json даже при установленном orjson
+if orjson is not None and app.config['JSON_PROVIDER'] != 'stdlib':
+    app.json = FastJSONProvider(app)
+else:
+    app.json = InstrumentedJSONProvider(app)
+
+@app.before_request
+def start_request_metrics():
+    """Начало отсчета времени запроса"""
+    g.request_started = time.perf_counter()
+    metrics.reset_timings()
+
+@app.after_request
+def record_request_metrics(response):
+    """Записывает время запроса и его составляющие в гистограммы маршрута"""
+    started = g.get('request_started')
+    if started is None:
+        return response
+
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    timings = metrics.get_timings()
+    registry = metrics.registry
+    registry.observe('http_request_duration_seconds', time.perf_counter() - started, route=route, method=request.method)
+    registry.observe('http_request_db_seconds', timings['db'], route=route, method=request.method)
+    registry.observe('http_request_serialize_seconds', timings['serialize'], route=route, method=request.method)
+    if timings['bcrypt']:
+        registry.observe('http_request_bcrypt_seconds', timings['bcrypt'], route=route, method=request.method)
+    if timings['compress']:
+        registry.observe('http_request_compress_seconds', timings['compress'], route=route, method=request.method)
+    registry.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+    return response
+
+# ======================
+# Сжатие ответов
+# ======================
+
+def compression(enabled=True, min_size=None, gzip_level=None, br_quality=None):
+    """
+    Настройки сжатия для маршрута; ставится сразу под @app.route.
+    Не указанные параметры берутся из COMPRESSION_* в app.config
+    """
+    def decorator(f):
+        f.compression = {'enabled': enabled, 'min_size': min_size,
+                         'gzip_level': gzip_level, 'br_quality': br_quality}
+        return f
+    return decorator
+
+@app.after_request
+def compress_response(response):
+    """Сжимает ответ gzip/brotli, если клиент указал их в Accept-Encoding"""
+    options = getattr(app.view_functions.get(request.endpoint), 'compression', {})
+    if not app.config['COMPRESSION_ENABLED'] or not options.get('enabled', True):
+        return response
+    if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    # Ответ зависит от Accept-Encoding — это важно для промежуточных кэшей
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    key = 'br_quality' if encoding == 'br' else 'gzip_level'
+    level = options.get(key)
+    if level is None:
+        level = app.config[f'COMPRESSION_{key.upper()}']
+
+    with metrics.timer('compress'):
+        if response.is_streamed:
+            # Потоковая выгрузка: сжимается по мере генерации
+            response.response = compress_stream(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            min_size = options.get('min_size')
+            if len(data) < (app.config['COMPRESSION_MIN_SIZE'] if min_size is None else min_size):
+                return response
+            response.set_data(compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    return response
 
 # ======================
 # Вспомогательные функции
 # ======================
 
+_pools = {}
+_pool_lock = threading.Lock()
+
+def get_shard_pool(index=0, read_only=False):
+    """
+    Пул соединений файла шарда (0 — основная база), создается при первом
+    обращении. Пул только для чтения — для GET-маршрутов: отдельный размер,
+    увеличенный кэш страниц и mmap
+    """
+    key = (index, read_only)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                path = shard_path(app.config['DATABASE'], index)
+                if read_only:
+                    pool = ConnectionPool(
+                        path,
+                        size=app.config['DB_READ_POOL_SIZE'],
+                        timeout=app.config['DB_TIMEOUT'],
+                        health_check_interval=app.config['DB_HEALTH_CHECK_INTERVAL'],
+                        factory=metrics.TimedConnection,
+                        read_only=True,
+                        cache_size_kb=app.config['DB_READ_CACHE_SIZE_KB'],
+                        mmap_size=app.config['DB_MMAP_SIZE']
+                    )
+                else:
+                    pool = ConnectionPool(
+                        path,
+                        size=app.config['DB_POOL_SIZE'],
+                        timeout=app.config['DB_TIMEOUT'],
+                        health_check_interval=app.config['DB_HEALTH_CHECK_INTERVAL'],
+                        factory=metrics.TimedConnection
+                    )
+                _pools[key] = pool
+    return pool
+
+def get_pool():
+    """Возвращает пул соединений основной базы, создавая его при первом обращении"""
+    return get_shard_pool(0)
+
+def get_read_pool():
+    """Пул соединений только для чтения основной базы"""
+    return get_shard_pool(0, read_only=True)
+
+def close_pools():
+    """
+    Закрывает пулы соединений. Вызывается в мастер-процессе перед fork:
+    соединения SQLite нельзя передавать дочерним процессам
+    """
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        _pools.clear()
+
+def get_db():
+    """Соединение текущего запроса (одно на запрос, из пула)"""
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+def get_read_db():
+    """Соединение только для чтения текущего запроса"""
+    if 'read_db' not in g:
+        g.read_db = get_read_pool().acquire()
+    return g.read_db
+
+def get_shard_db(index, read_only=False):
+    """Соединение текущего запроса с шардом; для шарда 0 — get_db/get_read_db"""
+    if index == 0:
+        return get_read_db() if read_only else get_db()
+    conns = g.setdefault('shard_dbs', {})
+    key = (index, read_only)
+    if key not in conns:
+        conns[key] = get_shard_pool(index, read_only).acquire()
+    return conns[key]
+
+@app.teardown_appcontext
+def release_db(exc):
+    """Возвращает соединения запроса в пулы"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+    conn = g.pop('read_db', None)
+    if conn is not None:
+        get_read_pool().release(conn)
+    for (index, read_only), conn in g.pop('shard_dbs', {}).items():
+        get_shard_pool(index, read_only).release(conn)
+
+def get_writer(index):
+    """Поток-писатель шарда, создается при первом обращении"""
+    writer = _writers.get(index)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(index)
+            if writer is None:
+                writer = _writers[index] = _make_writer(index)
+    return writer
+
+def write(fn, *args, shard=0):
+    """
+    Выполняет fn(conn, *args) в потоке-писателе шарда и возвращает ее результат
+    после коммита пачки. Ожидание учитывается как время SQLite запроса
+    """
+    with metrics.timer('db'):
+        return get_writer(shard).execute(fn, *args, timeout=app.config['WRITE_TIMEOUT'])
+
+def shutdown(timeout=None):
+    """Остановка фоновых потоков: архивация, запись очередей всех шардов, обслуживание WAL, пулы"""
+    archiver.stop(timeout=timeout)
+    for writer in list(_writers.values()):
+        writer.stop(timeout=timeout)
+    wal_maintenance.stop(timeout=timeout)
+    close_pools()
+
+# Результат проверки схемы при старте; обработчики на него полагаются
+schema_state = {'ready': False, 'version': None, 'error': None}
+_schema_lock = threading.Lock()
+
+def check_schema(conn, primary=True):
+    """Проверяет, что схема актуальна и нужные таблицы существуют (users — только в основной базе)"""
+    version = current_version(conn)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    missing = ({'users', 'requests'} if primary else {'requests'}) - tables
+    if missing:
+        raise sqlite3.DatabaseError(f'Отсутствуют таблицы: {", ".join(sorted(missing))}')
+    if version < LATEST_VERSION:
+        raise sqlite3.DatabaseError(f'Схема версии {version}, требуется {LATEST_VERSION}')
+    return version
+
 def init_db():
-    """Создает таблицы в базе данных при первом запуске"""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-
-    # Таблица пользователей
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        is_partner INTEGER NOT NULL DEFAULT 0
-    )
-    ''')
-
-    # Таблица заявок
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS requests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        content TEXT NOT NULL,
-        status TEXT DEFAULT 'new',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        user_id INTEGER REFERENCES users(id)
-    )
-    ''')
+    """
+    Фаза готовности: миграции схемы и ее проверка.
+    Результат кэшируется в schema_state, поэтому обработчики не проверяют
+    наличие файла и таблиц на каждый запрос
+    """
+    with _schema_lock:
+        try:
+            # Схема у всех шардов одна; шард 0 — основная база
+            for index in range(app.config['SHARD_COUNT']):
+                with get_shard_pool(index).connection() as conn:
+                    applied = migrate(conn, primary=index == 0)
+                    version = check_schema(conn, primary=index == 0)
+                if applied:
+                    print(f'Применены миграции схемы{f" (шард {index})" if index else ""}: {applied}')
+            rebalance_shards()
+        except sqlite3.Error as e:
+            schema_state.update(ready=False, error=str(e))
+            raise
+        schema_state.update(ready=True, version=version, error=None)
 
-    conn.commit()
-    conn.close()
+def rebalance_shards():
+    """
+    Раскладывает заявки по шардам, если SHARD_COUNT изменился с прошлого запуска.
+    Число шардов, по которому разложены данные, хранится в server_settings
+    основной базы и обновляется только после успешного переноса, поэтому
+    прерванный перенос продолжится при следующем старте
+    """
+    count = app.config['SHARD_COUNT']
+    with get_pool().connection() as conn:
+        row = conn.execute("SELECT value FROM server_settings WHERE key = 'shard_count'").fetchone()
+    previous = int(row[0]) if row else 1
+    if previous == count:
+        return 0
+
+    # Файлы шардов сверх нового числа освобождаются целиком
+    conns = [open_connection(shard_path(app.config['DATABASE'], index), app.config['DB_TIMEOUT'])
+             for index in range(max(previous, count))]
+    try:
+        for conn in conns[count:]:
+            migrate(conn, primary=False)
+        moved = rebalance(conns, count)
+        conns[0].execute(
+            "INSERT OR REPLACE INTO server_settings (key, value) VALUES ('shard_count', ?)", (str(count),)
+        )
+        conns[0].commit()
+    finally:
+        for conn in conns:
+            conn.close()
+    print(f'Заявки разложены по {count} шардам (было {previous}), перенесено строк: {moved}')
+    return moved
+
+def warm_up():
+    """
+    Прогрев процесса: открывает соединения обоих пулов и выполняет на них
+    частые выражения (кэш выражений соединения, страницы индексов в кэше)
+    """
+    count = app.config['DB_WARM_CONNECTIONS']
+    page_query, _ = build_requests_query('user_id = ?', (), limit=1)
+    reads = [
+        ('SELECT id, is_partner FROM users WHERE username = ?', ('',)),
+        ('SELECT version FROM list_versions WHERE scope = ?', ('all',)),
+        ('SELECT version FROM requests WHERE id = ?', (0,)),
+        (page_query, (0, 1)),
+    ]
+    get_read_pool().warm(count, reads)
+    get_pool().warm(min(count, 2), reads[:1])
+    for index in range(1, app.config['SHARD_COUNT']):
+        get_shard_pool(index, read_only=True).warm(count, reads[1:])
+
+@app.before_request
+def ensure_schema_ready():
+    """Если приложение запущено без init_db (например, под WSGI-сервером) — выполняем его один раз"""
+    if schema_state['ready'] or request.endpoint == 'healthz':
+        return None
+    try:
+        init_db()
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'База данных не готова: {str(e)}'}), 503
+    return None
+
+_background_pid = None
+
+@app.before_request
+def start_background_tasks():
+    """
+    Фоновые потоки запускаются по первому запросу в каждом процессе:
+    в мастере gunicorn до fork потоков быть не должно
+    """
+    global _background_pid
+    if _background_pid == os.getpid() or not schema_state['ready']:
+        return None
+    with _schema_lock:
+        if _background_pid != os.getpid():
+            if app.config['ARCHIVE_ENABLED']:
+                archiver.start()
+            if app.config['WAL_CHECKPOINT_ENABLED'] or app.config['SNAPSHOT_INTERVAL']:
+                wal_maintenance.start()
+            _background_pid = os.getpid()
+    return None
 
 def hash_password(password):
-    """Хеширует пароль с солью"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """Хеширует пароль с солью (в пуле bcrypt, может выбросить HasherBusy)"""
+    with metrics.timer('bcrypt'):
+        return password_hasher.hash(password)
 
 def check_password(hashed, password):
-    """Проверяет пароль"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    """Проверяет пароль (в пуле bcrypt, может выбросить HasherBusy)"""
+    with metrics.timer('bcrypt'):
+        return password_hasher.check(hashed, password)
+
+def busy_response():
+    """Ответ 503 при перегрузке пула bcrypt"""
+    response = jsonify({'success': False, 'message': 'Сервер перегружен, повторите запрос позже'})
+    response.headers['Retry-After'] = str(app.config['BCRYPT_RETRY_AFTER'])
+    return response, 503
+
+def too_many_requests(retry_after):
+    """Ответ 429 при превышении лимита частоты"""
+    response = jsonify({'success': False, 'message': 'Слишком много запросов, повторите позже'})
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response, 429
+
+def client_ip():
+    """
+    Адрес клиента. За RATE_LIMIT_PROXY_HOPS доверенными прокси это N-я справа
+    запись X-Forwarded-For — ее дописал ближайший к клиенту доверенный прокси.
+    Записи левее задает сам клиент, поэтому по ним лимит обходился бы подменой
+    """
+    hops = app.config['RATE_LIMIT_PROXY_HOPS']
+    if hops > 0:
+        forwarded = [addr.strip() for addr in request.headers.get('X-Forwarded-For', '').split(',') if addr.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.remote_addr or ''
 
 def create_token(username):
     """Генерирует JWT токен"""
@@ -61,19 +625,357 @@ def create_token(username):
         'exp': datetime.now(timezone.utc) + timedelta(hours=24)
     }, key= app.config['SECRET_KEY'], algorithm='HS256')
 
-def get_user_id(username):
-    """Получает ID пользователя по имени"""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+def get_identity(username, conn=None):
+    """Возвращает (id, is_partner) пользователя, используя кэш"""
+    if not username:
+        return None
+    identity = identity_cache.get(username)
+    if identity is not None:
+        return identity
+
+    cursor = (conn or get_read_db()).cursor()
+    cursor.execute('SELECT id, is_partner FROM users WHERE username = ?', (username,))
     user = cursor.fetchone()
-    conn.close()
-    return user[0] if user else None
+    if not user:
+        return None
+
+    identity = (user[0], user[1])
+    identity_cache.set(username, identity)
+    return identity
+
+def invalidate_user(username):
+    """Сбрасывает кэш после изменения строки пользователя"""
+    identity_cache.pop(username)
+
+def get_user_id(username, conn=None):
+    """Получает ID пользователя по имени (через соединение обработчика)"""
+    identity = get_identity(username, conn)
+    return identity[0] if identity else None
+
+def decode_token(token):
+    """Проверяет JWT; проверенные токены запоминаются до истечения exp"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+    exp = payload.get('exp')
+    ttl = exp - time.time() if exp else None
+    if ttl is None or ttl > 0:
+        token_cache.set(token, payload, ttl)
+    return payload
+
+# ======================
+# Декораторы авторизации
+# ======================
+
+def rate_limited(f):
+    """
+    Защита маршрутов с bcrypt: лимит частоты по IP и по имени пользователя
+    (429) и предел одновременных запросов (503). Проверки идут до обращения
+    к базе и bcrypt, поэтому отклоненный запрос почти ничего не стоит
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not app.config['RATE_LIMIT_ENABLED']:
+            return f(*args, **kwargs)
+        route = request.url_rule.rule
+
+        allowed, retry_after = ip_limit.hit(client_ip())
+        if allowed:
+            # Тело разбирается так же, как в обработчиках: JSON или форма
+            data = request.get_json(silent=True) if request.is_json else request.form
+            username = data.get('username') if isinstance(data, dict) else None
+            if isinstance(username, str) and username:
+                allowed, retry_after = user_limit.hit(username.lower())
+        if not allowed:
+            metrics.registry.inc('rate_limited_total', route=route, reason='rate')
+            return too_many_requests(retry_after)
+
+        if not auth_concurrency.try_acquire():
+            metrics.registry.inc('rate_limited_total', route=route, reason='concurrency')
+            return busy_response()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            auth_concurrency.release()
+    return decorated
+
+def require_auth(f):
+    """
+    Проверяет Bearer-токен и находит пользователя.
+    В обработчике доступны g.username, g.user_id, g.is_partner
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'success': False, 'message': 'Токен отсутствует'}), 401
+
+        parts = auth_header.split()
+        if len(parts) != 2:
+            return jsonify({'success': False, 'message': 'Недействительный токен'}), 401
+
+        try:
+            payload = decode_token(parts[1])
+        except jwt.ExpiredSignatureError:
+            return jsonify({'success': False, 'message': 'Срок действия токена истёк'}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({'success': False, 'message': 'Недействительный токен'}), 401
+
+        try:
+            identity = get_identity(payload.get('username'))
+        except sqlite3.Error as e:
+            return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
+        if not identity:
+            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+
+        g.username = payload.get('username')
+        g.user_id, g.is_partner = identity
+        return f(*args, **kwargs)
+    return decorated
+
+def require_admin(f):
+    """Как require_auth, но пропускает только администраторов (is_partner = 1)"""
+    @wraps(f)
+    @require_auth
+    def decorated(*args, **kwargs):
+        if g.is_partner != 1:
+            return jsonify({'success': False, 'message': 'Недостаточно прав (нужен администратор)'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+# ======================
+# Выборка списков заявок
+# ======================
+
+# Статусы, которые может выставить администратор
+ALLOWED_STATUSES = ['Pending', 'Accepted', 'Rejected', 'Completed']
+
+# Поле ответа -> SQL-выражение
+REQUEST_COLUMNS = {
+    'id': 'id',
+    'title': 'title',
+    'content': 'content',
+    'status': 'status',
+    'created_at': "strftime('%Y-%m-%d %H:%M:%S', created_at)",
+    'user_id': 'user_id'
+}
+DEFAULT_REQUEST_FIELDS = ['id', 'title', 'content', 'status', 'created_at']
+# Поля, доступные без токена: владелец заявки публичному списку не раскрывается
+PUBLIC_REQUEST_FIELDS = [f for f in REQUEST_COLUMNS if f != 'user_id']
+
+def encode_cursor(created_at, request_id):
+    """Курсор страницы: позиция (created_at, id) последней выданной строки"""
+    raw = f'{created_at}|{request_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(value):
+    """Разбирает курсор, ValueError при некорректном значении"""
+    try:
+        created_at, request_id = base64.urlsafe_b64decode(value.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return created_at, int(request_id)
+    except Exception:
+        raise ValueError('Некорректный курсор')
+
+def parse_list_args(allowed_fields=REQUEST_COLUMNS):
+    """
+    Читает параметры списка: ?limit=&after=&fields=
+    Без limit возвращается весь список (старый формат ответа).
+    allowed_fields — поля, которые можно запросить в fields=
+    """
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError('limit должен быть положительным целым числом')
+        limit = int(limit)
+        limit = min(limit, app.config['PAGE_MAX_LIMIT'])
+
+    after = request.args.get('after')
+    after = decode_cursor(after) if after else None
+
+    fields = request.args.get('fields')
+    if fields:
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in allowed_fields]
+        if unknown or not fields:
+            raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+    else:
+        fields = DEFAULT_REQUEST_FIELDS
+
+    return limit, after, fields
+
+def include_archived():
+    """?include_archived=1 — список вместе с архивом завершенных заявок"""
+    return request.args.get('include_archived') == '1'
+
+def build_requests_query(where, params, limit=None, after=None, fields=DEFAULT_REQUEST_FIELDS, archived=False):
+    """
+    SQL выборки заявок в порядке (created_at, id) DESC.
+    Первые две колонки (id, created_at) служебные — из них строится курсор.
+    archived=True добавляет заявки из requests_archive
+    """
+    columns = ', '.join(REQUEST_COLUMNS[f] for f in fields)
+    conditions = [where] if where else []
+    params = list(params)
+    if after:
+        conditions.append('(created_at, id) < (?, ?)')
+        params.extend(after)
+
+    select = f'SELECT id, created_at, {columns} FROM {{table}}'
+    if conditions:
+        select += ' WHERE ' + ' AND '.join(conditions)
+    if archived:
+        # Одинаковые условия для рабочей таблицы и архива
+        query = select.format(table='requests') + ' UNION ALL ' + select.format(table='requests_archive')
+        query += ' ORDER BY 2 DESC, 1 DESC'
+        params = params * 2
+    else:
+        query = select.format(table='requests') + ' ORDER BY created_at DESC, id DESC'
+    if limit:
+        # Одна лишняя строка показывает, есть ли следующая страница
+        query += ' LIMIT ?'
+        params.append(limit + 1)
+    return query, params
+
+def fetch_requests_page(cursor, where, params, limit=None, after=None, fields=DEFAULT_REQUEST_FIELDS, archived=False):
+    """
+    Выборка заявок с keyset-пагинацией.
+    Возвращает (список заявок, курсор следующей страницы или None)
+    """
+    query, params = build_requests_query(where, params, limit, after, fields, archived)
+    cursor.execute(query, params)
+    return requests_page(cursor.fetchall(), limit, fields)
+
+def fetch_shards_page(where, params, limit=None, after=None, fields=DEFAULT_REQUEST_FIELDS, archived=False):
+    """
+    fetch_requests_page по всем шардам: каждый шард отдает не больше limit + 1
+    строк в том же порядке, результаты сливаются по (created_at, id)
+    """
+    count = app.config['SHARD_COUNT']
+    if count == 1:
+        return fetch_requests_page(get_read_db().cursor(), where, params, limit, after, fields, archived)
+    query, params = build_requests_query(where, params, limit, after, fields, archived)
+    rows = merge_rows(
+        [get_shard_db(index, read_only=True).execute(query, params).fetchall() for index in range(count)],
+        limit + 1 if limit else None
+    )
+    return requests_page(list(rows), limit, fields)
+
+def requests_page(rows, limit, fields):
+    """(список заявок, курсор следующей страницы или None) из строк build_requests_query"""
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+
+    return [dict(zip(fields, row[2:])) for row in rows], next_cursor
+
+def list_response(items, next_cursor, paginated, etag=None):
+    """Ответ со списком заявок; next_cursor только для постраничных запросов"""
+    body = {'success': True, 'requests': items}
+    if paginated:
+        body['next_cursor'] = next_cursor
+    response = jsonify(body)
+    if etag:
+        set_etag(response, etag)
+    return response
+
+# ======================
+# Условные GET (ETag)
+# ======================
+
+def list_etag(conn, scope):
+    """
+    ETag списка из счетчика list_versions (ведется триггерами) и параметров
+    запроса. Строки requests при этом не читаются
+    """
+    return f'{scope}-{list_version(conn, scope)}-{zlib.crc32(request.query_string):08x}'
+
+def list_version(conn, scope):
+    row = conn.execute('SELECT version FROM list_versions WHERE scope = ?', (scope,)).fetchone()
+    return row[0] if row else 0
+
+def shards_list_etag(scope):
+    """ETag списка, собранного со всех шардов: версии шардов через точку"""
+    count = app.config['SHARD_COUNT']
+    if count == 1:
+        return list_etag(get_read_db(), scope)
+    versions = '.'.join(str(list_version(get_shard_db(index, read_only=True), scope)) for index in range(count))
+    return f'{scope}-{versions}-{zlib.crc32(request.query_string):08x}'
+
+def request_etag(request_id, version):
+    """ETag заявки по ее версии"""
+    return f'request:{request_id}-{version}'
+
+def set_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    # Клиент хранит копию, но перепроверяет ее каждый раз
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified(etag):
+    """True, если у клиента актуальная копия (If-None-Match)"""
+    return request.if_none_match.contains_weak(etag)
+
+def not_modified_response(etag):
+    return set_etag(Response(status=304), etag)
+
+def stream_format():
+    """
+    Формат потоковой выдачи: 'ndjson' (Accept: application/x-ndjson или
+    ?stream=ndjson), 'json' (?stream=1) или None для обычного ответа
+    """
+    stream = request.args.get('stream')
+    if stream == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        return 'ndjson'
+    if stream in ('1', 'true', 'json'):
+        return 'json'
+    return None
+
+def stream_requests(fmt, where, params, after=None, fields=DEFAULT_REQUEST_FIELDS, archived=False):
+    """
+    Отдает заявки потоком, читая курсор пачками через fetchmany.
+    Память не зависит от размера выборки. Генератор берет собственные
+    соединения из пулов: соединение запроса вернется в пул раньше, чем
+    закончится передача ответа. Курсоры шардов сливаются по (created_at, id)
+    """
+    query, params = build_requests_query(where, params, None, after, fields, archived)
+    batch_size = app.config['STREAM_BATCH_SIZE']
+    dumps = app.json.dumps
+
+    def generate():
+        with ExitStack() as stack:
+            cursors = []
+            for index in range(app.config['SHARD_COUNT']):
+                cursor = stack.enter_context(get_shard_pool(index, read_only=True).connection()).cursor()
+                cursor.execute(query, params)
+                cursors.append(cursor)
+            merged = merge_rows(cursors) if len(cursors) > 1 else None
+            if fmt == 'json':
+                yield '{"success": true, "requests": ['
+            first = True
+            while True:
+                rows = cursors[0].fetchmany(batch_size) if merged is None else list(islice(merged, batch_size))
+                if not rows:
+                    break
+                items = [dumps(dict(zip(fields, row[2:]))) for row in rows]
+                if fmt == 'ndjson':
+                    yield '\n'.join(items) + '\n'
+                else:
+                    yield ('' if first else ',') + ','.join(items)
+                first = False
+            if fmt == 'json':
+                yield ']}'
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(generate(), mimetype=mimetype)
 
 # ======================
 # Эндпоинты аутентификации
 # ======================
 @app.route('/api/register', methods=['POST'])
+@rate_limited
 def register():
     """
     Регистрация нового пользователя
@@ -119,9 +1021,7 @@ def register():
         # Подключение к БД с обработкой блокировок
         conn = None
         try:
-            conn = sqlite3.connect('users.db', timeout=30)
-            conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute("PRAGMA busy_timeout=30000")
+            conn = get_db()
             cursor = conn.cursor()
 
             # Проверка существующего пользователя
@@ -135,18 +1035,16 @@ def register():
 
             # Хеширование пароля
             try:
-                hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                hashed_pw = hash_password(password)
+            except HasherBusy:
+                return busy_response()
             except Exception as e:
                 response['message'] = f'Ошибка хеширования пароля: {str(e)}'
                 return jsonify(response), 500
 
-            # Создание пользователя
-            cursor.execute(
-                'INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
-                (username, email, hashed_pw)
-            )
-            user_id = cursor.lastrowid
-            conn.commit()
+            # Создание пользователя (через поток-писатель основной базы)
+            user_id = write(insert_user, username, email, hashed_pw)
+            invalidate_user(username)
 
             # Генерация токена
             try:
@@ -184,15 +1082,13 @@ def register():
             conn.rollback()
             response['message'] = f'Неизвестная ошибка базы данных: {str(e)}'
             return jsonify(response), 500
-        finally:
-            if conn:
-                conn.close()
 
     except Exception as e:
         response['message'] = f'Критическая ошибка сервера: {str(e)}'
         return jsonify(response), 500
 
 @app.route('/api/login', methods=['POST'])
+@rate_limited
 def login():
     if request.content_type not in ['application/json', 'multipart/form-data', 'application/x-www-form-urlencoded']:
         return jsonify({'success': False, 'message': 'Unsupported Media Type'}), 415
@@ -210,7 +1106,7 @@ def login():
 
     conn = None
     try:
-        conn = sqlite3.connect('users.db')
+        conn = get_db()
         cursor = conn.cursor()
 
         # Выбираем все необходимые поля, включая is_partner
@@ -227,7 +1123,19 @@ def login():
         stored_password = user[1]
         is_partner = user[2]  # Получаем значение is_partner
 
-        if check_password(stored_password, password):
+        try:
+            password_ok = check_password(stored_password, password)
+        except HasherBusy:
+            return busy_response()
+
+        if password_ok:
+            # Пароль верен: при смене work factor пересчитываем хеш
+            if password_hasher.needs_rehash(stored_password):
+                try:
+                    write(update_user_password, user_id, hash_password(password))
+                except (HasherBusy, sqlite3.Error):
+                    pass
+
             token = create_token(username)
             print(jsonify({
                 'success': True,
@@ -248,25 +1156,73 @@ def login():
 
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        if conn:
-            conn.close()
+
+# ======================
+# Мутации (выполняются потоком-писателем)
+# ======================
+
+def insert_user(conn, username, email, password):
+    """Создание пользователя; возвращает его id"""
+    return conn.execute(
+        'INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
+        (username, email, password)
+    ).lastrowid
+
+def update_user_password(conn, user_id, password):
+    """Замена хеша пароля (пересчет при смене work factor)"""
+    return conn.execute('UPDATE users SET password = ? WHERE id = ?', (password, user_id)).rowcount
+
+
+def insert_request(conn, title, content, status, user_id):
+    """Вставка заявки; возвращает ее id. При нескольких шардах id сравним с номером шарда"""
+    count = app.config['SHARD_COUNT']
+    if count == 1:
+        return conn.execute(
+            'INSERT INTO requests (title, content, status, user_id) VALUES (?, ?, ?, ?)',
+            (title, content, status, user_id)
+        ).lastrowid
+    return conn.execute(
+        'INSERT INTO requests (id, title, content, status, user_id) VALUES (?, ?, ?, ?, ?)',
+        (next_request_id(conn, shard_of(user_id, count), count), title, content, status, user_id)
+    ).lastrowid
+
+def update_request_fields(conn, request_id, title, content):
+    """Изменение заголовка и текста; возвращает число измененных строк"""
+    return conn.execute(
+        'UPDATE requests SET title = ?, content = ?, version = version + 1 WHERE id = ?',
+        (title, content, request_id)
+    ).rowcount
+
+def update_request_status_row(conn, request_id, status):
+    """Изменение статуса; возвращает число измененных строк"""
+    return conn.execute(
+        'UPDATE requests SET status = ?, version = version + 1 WHERE id = ?',
+        (status, request_id)
+    ).rowcount
+
+def delete_request_row(conn, request_id, owner_id=None):
+    """
+    Удаление заявки. С owner_id удаляется только заявка этого владельца.
+    Возвращает None, если заявки нет, False — если владелец другой, True — если удалена
+    """
+    row = conn.execute('SELECT user_id FROM requests WHERE id = ?', (request_id,)).fetchone()
+    if row is None:
+        return None
+    if owner_id is not None and row[0] != owner_id:
+        return False
+    conn.execute('DELETE FROM requests WHERE id = ?', (request_id,))
+    return True
 
 # ======================
 # Эндпоинты для заявок
 # ======================
 
 @app.route('/api/requests', methods=['POST'])
+@require_auth
 def create_request():
-    conn = None
     """Создание новой заявки"""
-    token = request.headers.get('Authorization')
-    if not token:
-        return jsonify({'success': False, 'message': 'Токен отсутствует'}), 401
-
     try:
-        decoded = jwt.decode(token.split()[1], app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = get_user_id(decoded['username'])
+        user_id = g.user_id
 
         data = request.json
         title = data.get('title')
@@ -276,21 +1232,11 @@ def create_request():
         if not all([title, content]):
             return jsonify({'success': False, 'message': 'Заполните все поля'}), 400
 
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-
-        # Вставляем новую заявку
-        cursor.execute(
-            'INSERT INTO requests (title, content, status, user_id) VALUES (?, ?, ?, ?)',
-            (data['title'], data['content'], data.get('status', 'new'), user_id)
-        )
-        conn.commit()
-
-        # Получаем ID ВСТАВЛЕННОЙ записи
-        new_id = cursor.lastrowid
+        # Вставляем новую заявку и получаем ID ВСТАВЛЕННОЙ записи
+        new_id = write(insert_request, data['title'], data['content'], data.get('status', 'new'), user_id,
+                       shard=user_shard(user_id))
 
         if not new_id:  # Если ID не получен
-            conn.rollback()
             return jsonify({
                 'success': False,
                 'message': 'Не удалось получить ID заявки'
@@ -310,37 +1256,67 @@ def create_request():
         }), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        if conn:
-            conn.close()
+
+def find_request(cursor, columns, request_id, tables=('requests', 'requests_archive')):
+    """Строка заявки по id: сначала рабочая таблица, затем архив"""
+    for table in tables:
+        cursor.execute(f'SELECT {columns} FROM {table} WHERE id = ?', (request_id,))
+        row = cursor.fetchone()
+        if row:
+            return row
+    return None
+
+def user_shard(user_id):
+    """Шард, в котором лежат заявки пользователя"""
+    return shard_of(user_id, app.config['SHARD_COUNT'])
+
+def locate_request(request_id, columns='id', tables=('requests', 'requests_archive')):
+    """
+    (шард, строка) заявки по id. Сначала проверяется шард, на который указывает id,
+    затем остальные: там лежат заявки, созданные до включения шардирования
+    """
+    count = app.config['SHARD_COUNT']
+    primary = request_id % count
+    for index in [primary] + [i for i in range(count) if i != primary]:
+        with get_shard_pool(index, read_only=True).connection() as conn:
+            row = find_request(conn.cursor(), columns, request_id, tables)
+        if row:
+            return index, row
+    return primary, None
+
+def missing_request_response(request_id):
+    """
+    Ответ на изменение заявки, которой нет в рабочей таблице:
+    409 — заявка перенесена в архив (архив только для чтения), иначе 404
+    """
+    if locate_request(request_id, tables=('requests_archive',))[1]:
+        return jsonify({'success': False, 'message': 'Заявка в архиве, изменить ее нельзя'}), 409
+    return jsonify({'success': False, 'message': 'Заявка не найдена'}), 404
+
+def request_shard(request_id):
+    """Шард рабочей таблицы, в котором лежит заявка (или должна лежать, если ее нет)"""
+    if app.config['SHARD_COUNT'] == 1:
+        return 0
+    return locate_request(request_id, tables=('requests',))[0]
 
 @app.route('/api/requests/<int:request_id>', methods=['GET'])
+@require_auth
 def get_single_request(request_id):
     """Получение конкретной заявки по ID"""
-    token = request.headers.get('Authorization')
-    if not token:
-        return jsonify({'success': False, 'message': 'Токен отсутствует'}), 401
-
-    conn = None
     try:
-        decoded = jwt.decode(token.split()[1], app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = get_user_id(decoded['username'])
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-
-        cursor.execute(
-            '''SELECT id, title, content, status, 
-               strftime('%Y-%m-%d %H:%M:%S', created_at) 
-               FROM requests WHERE id = ?''',
-            (request_id,)
+        # Условный запрос: сверяем только версию, без чтения содержимого
+        if request.if_none_match:
+            _, row = locate_request(request_id, 'version')
+            if row and not_modified(request_etag(request_id, row[0])):
+                return not_modified_response(request_etag(request_id, row[0]))
+
+        _, db_request = locate_request(
+            request_id,
+            "id, title, content, status, strftime('%Y-%m-%d %H:%M:%S', created_at), version"
         )
-        db_request = cursor.fetchone()
 
         if not db_request:
-            print(request_id, user_id)
             return jsonify({'success': False, 'message': f'Заявка не найдена '}), 404
 
         # Формируем ответ
@@ -354,87 +1330,48 @@ def get_single_request(request_id):
             },
             'success': True,
         }
-        return jsonify(response_data), 200
+        return set_etag(jsonify(response_data), request_etag(request_id, db_request[5])), 200
 
-    except jwt.ExpiredSignatureError:
-        return jsonify({'success': False, 'message': 'Срок действия токена истёк'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'success': False, 'message': 'Недействительный токен'}), 401
     except sqlite3.Error as e:
         return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'success': False, 'message': f'Неизвестная ошибка: {str(e)}'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/requestsByUserID', methods=['GET'])
+@require_auth
 def get_requests_by_user_ID():
     try:
-        # Проверка авторизации
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'success': False, 'message': 'Токен отсутствует'}), 401
-
-        # Получаем user_id из токена
-        decoded = jwt.decode(token.split()[1], app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = get_user_id(decoded['username'])
-
-        if not user_id:
-            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+        user_id = g.user_id
 
         # Получаем параметры запроса
         request_user_id = request.args.get('user_id')
         if request_user_id and int(request_user_id) != user_id:
             return jsonify({'success': False, 'message': 'Недостаточно прав'}), 403
 
-        conn = sqlite3.connect('users.db')
+        try:
+            limit, after, fields = parse_list_args()
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        conn = get_shard_db(user_shard(user_id), read_only=True)
         cursor = conn.cursor()
 
         # Запрос заявок
-        query = '''
-            SELECT id, title, content, status, 
-                   strftime('%Y-%m-%d %H:%M:%S', created_at) 
-            FROM requests 
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-        '''
-        cursor.execute(query, (user_id,))
-
-        requests = []
-        for row in cursor.fetchall():
-            requests.append({
-                'id': row[0],
-                'title': row[1],
-                'content': row[2],
-                'status': row[3],
-                'created_at': row[4]
-            })
+        etag = list_etag(conn, f'user:{user_id}')
+        if not_modified(etag):
+            return not_modified_response(etag)
 
-        return jsonify({
-            'success': True,
-            'requests': requests
-        })
+        requests, next_cursor = fetch_requests_page(cursor, 'user_id = ?', (user_id,), limit, after, fields,
+                                                      include_archived())
+        return list_response(requests, next_cursor, limit is not None, etag)
 
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/requests/<int:request_id>', methods=['PUT'])
+@require_auth
 def update_request(request_id):
     try:
-        # Проверка токена
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'success': False, 'message': 'Токен отсутствует'}), 401
-
-        try:
-            decoded = jwt.decode(token.split()[1], app.config['SECRET_KEY'], algorithms=['HS256'])
-        except Exception as e:
-            return jsonify({'success': False, 'message': f'Ошибка токена: {str(e)}'}), 401
-
         # Проверка Content-Type
         if not request.is_json:
             return jsonify({'success': False, 'message': 'Требуется application/json'}), 400
@@ -454,21 +1391,13 @@ def update_request(request_id):
             return jsonify({'success': False, 'message': 'Поля не могут быть пустыми'}), 400
 
         # Обновление в БД
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-
         try:
-            cursor.execute('''
-                UPDATE requests 
-                SET title = ?, content = ?
-                WHERE id = ?
-            ''', (data['title'], data['content'], request_id))
-            conn.commit()
+            updated = write(update_request_fields, request_id, data['title'], data['content'],
+                            shard=request_shard(request_id))
+            if not updated:
+                return missing_request_response(request_id)
         except sqlite3.Error as e:
-            conn.rollback()
             return jsonify({'success': False, 'message': f'Ошибка БД: {str(e)}'}), 500
-        finally:
-            conn.close()
 
         return jsonify({
             'success': True,
@@ -485,147 +1414,64 @@ def update_request(request_id):
 
 
 @app.route('/api/requests/<int:request_id>', methods=['DELETE'])
+@require_auth
 def delete_request(request_id):
     """Удаление заявки"""
-    token = request.headers.get('Authorization')
-    if not token:
-        return jsonify({'success': False, 'message': 'Токен отсутствует'}), 401
-
-    conn = None
     try:
-        # Проверяем токен
-        try:
-            decoded = jwt.decode(token.split()[1], app.config['SECRET_KEY'], algorithms=['HS256'])
-        except Exception as e:
-            return jsonify({'success': False, 'message': f'Ошибка токена: {str(e)}'}), 401
+        # Проверка владельца и удаление — одна операция потока-писателя
+        deleted = write(delete_request_row, request_id, g.user_id, shard=request_shard(request_id))
 
-        user_id = get_user_id(decoded['username'])
-        if not user_id:
-            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
-
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
+        if deleted is None:
+            return missing_request_response(request_id)
 
-        # Проверяем, существует ли заявка и принадлежит ли пользователю
-        cursor.execute('SELECT user_id FROM requests WHERE id = ?', (request_id,))
-        request_data = cursor.fetchone()
-
-        if not request_data:
-            return jsonify({'success': False, 'message': 'Заявка не найдена'}), 404
-
-        if request_data[0] != user_id :
-            print(user_id)
-            return jsonify({'success': False, 'message': 'Недостаточно прав'}), 403 ## request_data[0] != user_id???
-
-        # Удаляем заявку
-        cursor.execute('DELETE FROM requests WHERE id = ?', (request_id,))
-        conn.commit()
+        if not deleted:
+            return jsonify({'success': False, 'message': 'Недостаточно прав'}), 403
 
         return jsonify({'success': True, 'message': 'Заявка удалена'}), 200
 
     except sqlite3.Error as e:
-        if conn:
-            conn.rollback()
         return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'success': False, 'message': f'Неизвестная ошибка: {str(e)}'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/requestsAdmin/<int:request_id>', methods=['DELETE'])
+@require_admin
 def delete_request_admin(request_id):
     """Удаление заявки (администратором, если is_partner = 1)"""
-    token = request.headers.get('Authorization')
-    if not token:
-        return jsonify({'success': False, 'message': 'Токен отсутствует'}), 401
-
-    conn = None
     try:
-        # Проверяем токен
-        try:
-            decoded = jwt.decode(token.split()[1], app.config['SECRET_KEY'], algorithms=['HS256'])
-        except Exception as e:
-            return jsonify({'success': False, 'message': f'Ошибка токена: {str(e)}'}), 401
-
-        username = decoded.get('username')
-        user_id = get_user_id(username)
-        if not user_id:
-            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
-
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-
-        # Проверяем, является ли пользователь администратором (is_partner = 1)
-        cursor.execute('SELECT is_partner FROM users WHERE id = ?', (user_id,))
-        user_data = cursor.fetchone()
-
-        if not user_data:
-            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
-
-        if user_data[0] != 1:
-            return jsonify({'success': False, 'message': 'Недостаточно прав (нужен администратор)'}), 403
-
-        # Проверяем, существует ли заявка
-        cursor.execute('SELECT id FROM requests WHERE id = ?', (request_id,))
-        if not cursor.fetchone():
-            return jsonify({'success': False, 'message': 'Заявка не найдена'}), 404
-
-        # Удаляем заявку
-        cursor.execute('DELETE FROM requests WHERE id = ?', (request_id,))
-        conn.commit()
+        if not write(delete_request_row, request_id, shard=request_shard(request_id)):
+            return missing_request_response(request_id)
 
         return jsonify({'success': True, 'message': f'Заявка {request_id} удалена администратором'}), 200
 
     except sqlite3.Error as e:
-        if conn:
-            conn.rollback()
         return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'success': False, 'message': f'Неизвестная ошибка: {str(e)}'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/requests', methods=['GET'])
+@compression(gzip_level=4, br_quality=4)
 def get_all_requests():
     """Получение ВСЕХ заявок (без проверки токена и фильтрации)"""
     conn = None
     try:
-        # Проверка существования файла БД
-        db_path = 'users.db'
-        if not os.path.exists(db_path):
-            return jsonify({
-                'success': False,
-                'message': 'Database file not found'
-            }), 500
-
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        try:
+            limit, after, fields = parse_list_args(PUBLIC_REQUEST_FIELDS)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
 
-        # Проверка существования таблицы
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='requests'")
-        if not cursor.fetchone():
-            return jsonify({
-                'success': False,
-                'message': 'Table "requests" does not exist'
-            }), 500
+        # Выгрузка потоком для больших таблиц
+        fmt = stream_format()
+        if fmt:
+            return stream_requests(fmt, None, (), after, fields, include_archived())
 
-        # Получение данных
-        cursor.execute('''
-            SELECT id, title, content, status, created_at
-            FROM requests
-            ORDER BY created_at DESC
-        ''')
+        etag = shards_list_etag('all')
+        if not_modified(etag):
+            return not_modified_response(etag)
 
-        # Форматирование результата
-        columns = [desc[0] for desc in cursor.description]
-        requests = [dict(zip(columns, row)) for row in cursor.fetchall()]
-
-        return jsonify({
-            'success': True,
-            'requests': requests
-        })
+        # Получение данных (со всех шардов)
+        requests, next_cursor = fetch_shards_page(None, (), limit, after, fields, include_archived())
+        return list_response(requests, next_cursor, limit is not None, etag)
 
     except sqlite3.Error as e:
         return jsonify({
@@ -639,80 +1485,45 @@ def get_all_requests():
             'message': f'Server error: {str(e)}'
         }), 500
 
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/request', methods=['GET'])
+@require_auth
 def get_requests():
     """Получение заявок с проверкой токена и фильтрацией по пользователю"""
-    # Проверка авторизации
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({'success': False, 'message': 'Authorization token is missing'}), 401
-
     try:
-        # Извлечение и проверка токена
-        token = auth_header.split()[1]  # Формат: Bearer <token>
-        decoded_token = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = decoded_token.get('user_id')
-
-        if not user_id:
-            return jsonify({'success': False, 'message': 'Invalid token'}), 401
+        user_id = g.user_id
 
-        # Подключение к БД
-        db_path = 'users.db'
-        if not os.path.exists(db_path):
-            return jsonify({'success': False, 'message': 'Database file not found'}), 500
+        try:
+            limit, after, fields = parse_list_args()
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
 
-        conn = sqlite3.connect(db_path)
+        # Подключение к БД (шарду пользователя)
+        conn = get_shard_db(user_shard(user_id), read_only=True)
         cursor = conn.cursor()
 
-        # Проверка существования таблицы
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='requests'")
-        if not cursor.fetchone():
-            return jsonify({'success': False, 'message': 'Table "requests" does not exist'}), 500
-
         # Получение заявок для конкретного пользователя
-        cursor.execute('''
-            SELECT id, title, content, status, created_at
-            FROM requests
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-        ''', (user_id,))
+        etag = list_etag(conn, f'user:{user_id}')
+        if not_modified(etag):
+            return not_modified_response(etag)
 
-        # Форматирование результата
-        columns = [desc[0] for desc in cursor.description]
-        requests = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        requests, next_cursor = fetch_requests_page(cursor, 'user_id = ?', (user_id,), limit, after, fields,
+                                                      include_archived())
+        return list_response(requests, next_cursor, limit is not None, etag)
 
-        return jsonify({
-            'success': True,
-            'requests': requests
-        })
-
-    except jwt.ExpiredSignatureError:
-        return jsonify({'success': False, 'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'success': False, 'message': 'Invalid token'}), 401
     except sqlite3.Error as e:
         return jsonify({'success': False, 'message': f'Database error: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'success': False, 'message': f'Server error: {str(e)}'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 # ======================
 # Сверху работает
 # ======================
 
 @app.route('/api/requestsAdminAccept/<int:request_id>', methods=['PATCH'])
+@require_admin
 def update_request_status(request_id):
     """Изменение статуса заявки администратором"""
-    token = request.headers.get('Authorization')
-    if not token:
-        return jsonify({'success': False, 'message': 'Токен отсутствует'}), 401
-
     # Получаем данные из тела запроса
     data = request.get_json()
     if not data or 'status' not in data:
@@ -721,131 +1532,589 @@ def update_request_status(request_id):
     new_status = data['status']
 
     # Проверяем допустимые статусы
-    allowed_statuses = ['Pending', 'Accepted', 'Rejected', 'Completed']
-    if new_status not in allowed_statuses:
+    if new_status not in ALLOWED_STATUSES:
         return jsonify(
-            {'success': False, 'message': f'Недопустимый статус. Допустимые: {", ".join(allowed_statuses)}'}), 400
+            {'success': False, 'message': f'Недопустимый статус. Допустимые: {", ".join(ALLOWED_STATUSES)}'}), 400
 
-    conn = None
     try:
-        # Проверяем токен
-        try:
-            decoded = jwt.decode(token.split()[1], app.config['SECRET_KEY'], algorithms=['HS256'])
-        except Exception as e:
-            return jsonify({'success': False, 'message': f'Ошибка токена: {str(e)}'}), 401
+        # Обновляем статус заявки; 0 измененных строк — заявки нет или она в архиве
+        if not write(update_request_status_row, request_id, new_status, shard=request_shard(request_id)):
+            return missing_request_response(request_id)
 
-        username = decoded.get('username')
-        user_id = get_user_id(username)
-        if not user_id:
-            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+        return jsonify({
+            'success': True,
+            'message': f'Статус заявки {request_id} изменен на "{new_status}"'
+        }), 200
 
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Неизвестная ошибка: {str(e)}'}), 500
 
-        # Проверяем, является ли пользователь администратором (is_partner = 1)
-        cursor.execute('SELECT is_partner FROM users WHERE id = ?', (user_id,))
-        user_data = cursor.fetchone()
 
-        if not user_data:
-            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+# ======================
+# Полнотекстовый поиск
+# ======================
 
-        if user_data[0] != 1:
-            return jsonify({'success': False, 'message': 'Недостаточно прав (нужен администратор)'}), 403
+# Разметка совпадений в title и snippet (rich text TextMeshPro понимает <b>)
+SEARCH_HIGHLIGHT_OPEN = '<b>'
+SEARCH_HIGHLIGHT_CLOSE = '</b>'
+# Вес совпадения в заголовке относительно текста заявки
+SEARCH_TITLE_WEIGHT = 10.0
 
-        # Проверяем, существует ли заявка
-        cursor.execute('SELECT id FROM requests WHERE id = ?', (request_id,))
-        if not cursor.fetchone():
-            return jsonify({'success': False, 'message': 'Заявка не найдена'}), 404
+def build_match_query(text):
+    """
+    MATCH-запрос FTS5 из пользовательского текста: все слова обязательны,
+    последнее ищется как префикс. Синтаксис FTS5 из ввода не пропускается
+    """
+    terms = re.findall(r'\w+', text or '')[:app.config['SEARCH_MAX_TERMS']]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+@app.route('/api/requests/search', methods=['GET'])
+@require_auth
+def search_requests():
+    """
+    Поиск заявок по title и content: ?q=&limit=&offset=
+    Результаты ранжированы (bm25), совпадения выделены в title и snippet
+    """
+    match = build_match_query(request.args.get('q'))
+    if not match:
+        return jsonify({'success': False, 'message': 'Пустой поисковый запрос'}), 400
+
+    limit = request.args.get('limit', str(app.config['SEARCH_DEFAULT_LIMIT']))
+    offset = request.args.get('offset', '0')
+    if not limit.isdigit() or not offset.isdigit() or int(limit) < 1:
+        return jsonify({'success': False, 'message': 'Некорректные параметры пагинации'}), 400
+    limit = min(int(limit), app.config['PAGE_MAX_LIMIT'])
+    offset = int(offset)
+
+    query = f'''SELECT r.id,
+                       highlight(requests_fts, 0, ?, ?),
+                       snippet(requests_fts, 1, ?, ?, '…', 16),
+                       r.status,
+                       strftime('%Y-%m-%d %H:%M:%S', r.created_at),
+                       bm25(requests_fts, {SEARCH_TITLE_WEIGHT}, 1.0) AS score
+                FROM requests_fts
+                JOIN requests r ON r.id = requests_fts.rowid
+                WHERE requests_fts MATCH ?
+                ORDER BY score, r.id DESC
+                LIMIT ? OFFSET ?'''
+    params = (SEARCH_HIGHLIGHT_OPEN, SEARCH_HIGHLIGHT_CLOSE,
+              SEARCH_HIGHLIGHT_OPEN, SEARCH_HIGHLIGHT_CLOSE,
+              match)
 
-        # Обновляем статус заявки
-        cursor.execute(
-            'UPDATE requests SET status = ? WHERE id = ?',
-            (new_status, request_id)
-        )
-        conn.commit()
+    try:
+        count = app.config['SHARD_COUNT']
+        if count == 1:
+            cursor = get_read_db().cursor()
+            cursor.execute(query, params + (limit + 1, offset))
+            rows = cursor.fetchall()
+        else:
+            # Каждый шард отдает первые offset + limit + 1 результатов, они сливаются по score.
+            # bm25 считается по статистике своего шарда, поэтому порядок между шардами приближенный
+            rows = heapq.merge(
+                *[get_shard_db(index, read_only=True).execute(query, params + (offset + limit + 1, 0)).fetchall()
+                  for index in range(count)],
+                key=lambda row: (row[5], -row[0])
+            )
+            rows = list(islice(rows, offset, offset + limit + 1))
+
+        has_more = len(rows) > limit
+        results = [{
+            'id': row[0],
+            'title': row[1],
+            'snippet': row[2],
+            'status': row[3],
+            'created_at': row[4],
+            'score': -row[5]  # bm25 в SQLite отрицательный: чем меньше, тем лучше
+        } for row in rows[:limit]]
 
         return jsonify({
             'success': True,
-            'message': f'Статус заявки {request_id} изменен на "{new_status}"'
+            'requests': results,
+            'next_offset': offset + limit if has_more else None
         }), 200
 
     except sqlite3.Error as e:
-        if conn:
-            conn.rollback()
+        return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
+
+# ======================
+# Пакетные операции администратора
+# ======================
+
+def parse_bulk_ids(values):
+    """Проверяет список ID пакетного запроса, ValueError при ошибке"""
+    if not isinstance(values, list) or not values:
+        raise ValueError('Требуется непустой список ids')
+    if len(values) > app.config['BULK_MAX_ITEMS']:
+        raise ValueError(f'Не более {app.config["BULK_MAX_ITEMS"]} заявок за запрос')
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        raise ValueError('ids должны быть целыми числами')
+    return values
+
+def apply_bulk(ids, apply):
+    """
+    Выполняет apply(conn, ids) потоком-писателем каждого шарда для еще
+    не найденных ids — одной операцией (и транзакцией) на шард. apply
+    возвращает id строк, которые он реально изменил (RETURNING): проверка
+    существования и запись неразделимы, поэтому заявка, удаленная или
+    архивированная параллельно, не попадет в ответ как измененная.
+    Возвращает множество измененных id
+    """
+    changed = set()
+    for index in range(app.config['SHARD_COUNT']):
+        pending = [request_id for request_id in ids if request_id not in changed]
+        if not pending:
+            break
+        changed.update(write(apply, pending, shard=index))
+    return changed
+
+@app.route('/api/requestsAdminAccept/bulk', methods=['PATCH'])
+@require_admin
+def update_request_status_bulk():
+    """
+    Пакетное изменение статусов администратором.
+    Тело: {"items": [{"id": 1, "status": "Accepted"}, ...]}
+    или {"ids": [1, 2], "status": "Accepted"}.
+    Все изменения применяются одной транзакцией (при нескольких шардах —
+    одной на шард), результат — по каждой заявке
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Требуется application/json'}), 400
+
+    if 'items' in data:
+        items = data['items']
+        if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+            return jsonify({'success': False, 'message': 'items должен быть списком объектов'}), 400
+        pairs = [(item.get('id'), item.get('status')) for item in items]
+    else:
+        pairs = [(request_id, data.get('status')) for request_id in (data.get('ids') or [])]
+
+    try:
+        parse_bulk_ids([request_id for request_id, _ in pairs])
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    # Повторяющийся ID: действует последний статус
+    statuses = {}
+    for request_id, new_status in pairs:
+        statuses[request_id] = new_status
+
+    def update_statuses(conn, ids):
+        # Одно UPDATE на статус; RETURNING — заявки, которые действительно изменены
+        by_status = {}
+        for request_id in ids:
+            by_status.setdefault(statuses[request_id], []).append(request_id)
+        return [
+            row[0]
+            for new_status, group in by_status.items()
+            for row in conn.execute(
+                '''UPDATE requests SET status = ?, version = version + 1
+                   WHERE id IN (SELECT value FROM json_each(?)) RETURNING id''',
+                (new_status, json.dumps(group))
+            ).fetchall()
+        ]
+
+    try:
+        valid = [request_id for request_id, new_status in statuses.items() if new_status in ALLOWED_STATUSES]
+        updated = apply_bulk(valid, update_statuses)
+
+        results = []
+        for request_id, new_status in statuses.items():
+            if new_status not in ALLOWED_STATUSES:
+                results.append({'id': request_id, 'success': False, 'message': 'Недопустимый статус'})
+            elif request_id not in updated:
+                results.append({'id': request_id, 'success': False, 'message': 'Заявка не найдена'})
+            else:
+                results.append({'id': request_id, 'success': True, 'status': new_status})
+
+        return jsonify({'success': True, 'updated': len(updated), 'results': results}), 200
+
+    except sqlite3.Error as e:
         return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'success': False, 'message': f'Неизвестная ошибка: {str(e)}'}), 500
-    finally:
-        if conn:
-            conn.close()
 
+@app.route('/api/requestsAdmin/bulk-delete', methods=['POST'])
+@require_admin
+def delete_request_admin_bulk():
+    """
+    Пакетное удаление заявок администратором.
+    Тело: {"ids": [1, 2, 3]}; удаление одной транзакцией (на шард)
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Требуется application/json'}), 400
+
+    try:
+        ids = list(dict.fromkeys(parse_bulk_ids(data.get('ids'))))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    def delete_requests(conn, ids):
+        return [row[0] for row in conn.execute(
+            'DELETE FROM requests WHERE id IN (SELECT value FROM json_each(?)) RETURNING id',
+            (json.dumps(ids),)
+        ).fetchall()]
+
+    try:
+        deleted = apply_bulk(ids, delete_requests)
+
+        results = [
+            {'id': request_id, 'success': True} if request_id in deleted
+            else {'id': request_id, 'success': False, 'message': 'Заявка не найдена'}
+            for request_id in ids
+        ]
+        return jsonify({'success': True, 'deleted': len(deleted), 'results': results}), 200
+
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Неизвестная ошибка: {str(e)}'}), 500
 
 @app.route('/api/requests/by-status/<status>', methods=['GET'])
+@compression(gzip_level=4, br_quality=4)
+@require_admin
 def get_requests_by_status(status):
     """Получение заявок по статусу"""
-    token = request.headers.get('Authorization')
-    if not token:
-        return jsonify({'success': False, 'message': 'Токен отсутствует'}), 401
-
-    conn = None
     try:
-        # Проверяем токен
         try:
-            decoded = jwt.decode(token.split()[1], app.config['SECRET_KEY'], algorithms=['HS256'])
-        except Exception as e:
-            return jsonify({'success': False, 'message': f'Ошибка токена: {str(e)}'}), 401
+            limit, after, fields = parse_list_args()
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
 
-        username = decoded.get('username')
-        user_id = get_user_id(username)
-        if not user_id:
-            return jsonify({'success': False, 'message': 'Пользователь не найден'}), 404
+        # Выгрузка потоком для больших таблиц
+        fmt = stream_format()
+        if fmt:
+            return stream_requests(fmt, 'status = ?', (status,), after, fields, include_archived())
 
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
+        # Статус входит в путь, а не в query string — учитываем его в области
+        etag = shards_list_etag('all') + f'-{zlib.crc32(status.encode("utf-8")):08x}'
+        if not_modified(etag):
+            return not_modified_response(etag)
+
+        # Получаем заявки по статусу (со всех шардов)
+        result, next_cursor = fetch_shards_page('status = ?', (status,), limit, after, fields, include_archived())
+        return list_response(result, next_cursor, limit is not None, etag), 200
 
-        # Проверяем права администратора
-        cursor.execute('SELECT is_partner FROM users WHERE id = ?', (user_id,))
-        user_data = cursor.fetchone()
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Неизвестная ошибка: {str(e)}'}), 500
 
-        if not user_data or user_data[0] != 1:
+@app.route('/api/requests/stats', methods=['GET'])
+@require_auth
+def get_request_stats():
+    """
+    Число заявок по статусам из request_stats (ведется триггерами), без чтения requests.
+    Администратор получает общую статистику или статистику ?user_id=,
+    пользователь — свою. ?include_archived=1 добавляет заявки из архива
+    """
+    user_id = request.args.get('user_id')
+    if user_id is not None:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'user_id должен быть целым числом'}), 400
+    if g.is_partner != 1:
+        if user_id is not None and user_id != g.user_id:
             return jsonify({'success': False, 'message': 'Недостаточно прав'}), 403
+        user_id = g.user_id
+    scope = 'all' if user_id is None else f'user:{user_id}'
 
-        # Получаем заявки по статусу
-        cursor.execute(
-            '''SELECT id, title, content, status, 
-               strftime('%Y-%m-%d %H:%M:%S', created_at) 
-               FROM requests WHERE status = ?''',
-            (status,)
-        )
+    try:
+        # Общая статистика складывается из шардов, пользовательская лежит в шарде пользователя
+        if user_id is None:
+            conns = [get_shard_db(index, read_only=True) for index in range(app.config['SHARD_COUNT'])]
+            etag = shards_list_etag(scope)
+        else:
+            conns = [get_shard_db(user_shard(user_id), read_only=True)]
+            etag = list_etag(conns[0], scope)
+        if not_modified(etag):
+            return not_modified_response(etag)
+
+        archived = include_archived()
+        by_status = {}
+        for conn in conns:
+            for status, count, in_archive in conn.execute(
+                'SELECT status, count, archived FROM request_stats WHERE scope = ?', (scope,)
+            ):
+                count += in_archive if archived else 0
+                if count:
+                    by_status[status] = by_status.get(status, 0) + count
+
+        return set_etag(jsonify({
+            'success': True,
+            'scope': scope,
+            'total': sum(by_status.values()),
+            'by_status': by_status
+        }), etag), 200
 
-        requests = cursor.fetchall()
-        result = []
-        for req in requests:
-            result.append({
-                'id': req[0],
-                'title': req[1],
-                'content': req[2],
-                'status': req[3],
-                'created_at': req[4]
-            })
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
+
+# ======================
+# Лента изменений
+# ======================
+
+def parse_changes_args():
+    """
+    Параметры ленты: since, request_id, all (только для администратора).
+    Без request_id отслеживается список заявок текущего пользователя;
+    request_id пользователя ограничен его собственными заявками.
+    Для all=1 при нескольких шардах since — позиция 'seq0.seq1...'
+    """
+    since = request.args.get('since') or request.headers.get('Last-Event-ID')
+    request_id = request.args.get('request_id')
+    if request_id is not None:
+        request_id = int(request_id)
+    watch_all = request.args.get('all') == '1'
+    is_admin = g.is_partner == 1
+    if watch_all and not is_admin:
+        raise PermissionError('Недостаточно прав (нужен администратор)')
+    if watch_all or (request_id is not None and is_admin):
+        user_id = None
+    else:
+        user_id = g.user_id
+    if since in (None, ''):
+        since = None
+    elif changes_shard(request_id, user_id) is None:
+        since = encode_position(decode_position(since, app.config['SHARD_COUNT']))
+    else:
+        since = int(since)
+    return since, request_id, user_id
+
+def changes_shard(request_id, user_id):
+    """Шард, лента которого отслеживается; None — лента всех шардов (all=1)"""
+    if app.config['SHARD_COUNT'] == 1:
+        return 0
+    if request_id is not None:
+        return locate_request(request_id)[0]
+    if user_id is not None:
+        return user_shard(user_id)
+    return None
+
+def read_changes(since, request_id, user_id):
+    """Изменения после since; соединение берется только на время запроса"""
+    index = changes_shard(request_id, user_id)
+    if index is None:
+        return read_all_changes(since)
+    with get_shard_pool(index, read_only=True).connection() as conn:
+        return fetch_changes(conn, since, request_id, user_id)
+
+def read_all_changes(since):
+    """
+    Изменения всех шардов после позиции since. Порядок внутри шарда
+    сохраняется; seq каждого изменения — позиция ленты сразу после него
+    """
+    seqs = decode_position(since, app.config['SHARD_COUNT'])
+    changes = []
+    for index, shard_since in enumerate(list(seqs)):
+        with get_shard_pool(index, read_only=True).connection() as conn:
+            for change in fetch_changes(conn, shard_since):
+                seqs[index] = change['seq']
+                changes.append(dict(change, seq=encode_position(seqs)))
+    return changes
+
+def prepare_changes(stream=False):
+    """
+    Общая часть /api/changes и /api/changes/stream (после require_auth):
+    разбор параметров и ответы, не требующие ожидания.
+    Возвращает готовый ответ либо None — тогда параметры ожидания
+    (since, request_id, user_id, timeout, current) лежат в g.changes_wait.
+    Используется и асинхронным режимом (asgi.py)
+    """
+    try:
+        since, request_id, user_id = parse_changes_args()
+        timeout = None
+        if not stream:
+            timeout = min(float(request.args.get('timeout', app.config['CHANGES_MAX_WAIT'])),
+                          app.config['CHANGES_MAX_WAIT'])
+    except PermissionError as e:
+        return jsonify({'success': False, 'message': str(e)}), 403
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Некорректные параметры'}), 400
+
+    try:
+        index = changes_shard(request_id, user_id)
+        if index is None:
+            conns = [get_shard_db(i, read_only=True) for i in range(app.config['SHARD_COUNT'])]
+            current = encode_position(latest_seq(conn) for conn in conns)
+        else:
+            conns = [get_shard_db(index, read_only=True)]
+            current = latest_seq(conns[0])
+        if since is None:
+            if not stream:
+                return jsonify({'success': True, 'seq': current, 'changes': []}), 200
+            since = current
+        elif not stream:
+            positions = [since] if index is not None else decode_position(since, len(conns))
+            if any(oldest is not None and position < oldest - 1
+                   for position, oldest in zip(positions, (oldest_seq(conn) for conn in conns))):
+                # Часть изменений уже удалена из ленты — клиенту нужно перечитать данные
+                return jsonify({'success': True, 'seq': current, 'changes': [], 'reset': True}), 200
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
+
+    g.changes_wait = (since, request_id, user_id, max(timeout or 0, 0), current)
+    return None
+
+def changes_payload(since, current, changes):
+    """Тело ответа long-poll"""
+    if changes:
+        seq = changes[-1]['seq']
+    elif isinstance(since, str):  # позиция ленты всех шардов
+        seq = later_position(since, current)
+    else:
+        seq = max(since, current)
+    return {'success': True, 'seq': seq, 'changes': changes}
+
+def change_event(change):
+    """Событие SSE для одного изменения"""
+    return f'id: {change["seq"]}\nevent: change\ndata: {json.dumps(change)}\n\n'
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+@app.route('/api/changes', methods=['GET'])
+@require_auth
+def get_changes():
+    """
+    Long-poll: ждет изменений заявки (?request_id=) или списка пользователя
+    после номера ?since= не дольше ?timeout= секунд.
+    Без since сразу возвращает текущий номер — с него клиент начинает ждать
+    """
+    response = prepare_changes()
+    if response is not None:
+        return response
+    since, request_id, user_id, timeout, current = g.changes_wait
+
+    try:
+        # Во время ожидания соединение запроса не занимает место в пуле
+        release_db(None)
+        changes = change_feed.wait(lambda: read_changes(since, request_id, user_id), timeout)
+        return jsonify(changes_payload(since, current, changes)), 200
+
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
+
+@app.route('/api/changes/stream', methods=['GET'])
+@require_auth
+def stream_changes():
+    """
+    Server-Sent Events: событие change на каждое изменение, комментарий-пинг
+    при простое. Поддерживает Last-Event-ID для продолжения после обрыва
+    """
+    response = prepare_changes(stream=True)
+    if response is not None:
+        return response
+    since, request_id, user_id, _, _ = g.changes_wait
+
+    heartbeat = app.config['CHANGES_STREAM_HEARTBEAT']
+    max_age = app.config['CHANGES_STREAM_MAX_AGE']
+
+    def generate():
+        position = since
+        deadline = time.monotonic() + max_age
+        yield f'retry: 3000\nid: {position}\n\n'
+        while time.monotonic() < deadline:
+            changes = change_feed.wait(lambda: read_changes(position, request_id, user_id), heartbeat)
+            if not changes:
+                yield ': ping\n\n'
+                continue
+            for change in changes:
+                yield change_event(change)
+            position = changes[-1]['seq']
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers.update(SSE_HEADERS)
+    return response
+
+# ======================
+# Служебные эндпоинты
+# ======================
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Готовность сервера: схема проверена и база отвечает"""
+    if not schema_state['ready']:
         return jsonify({
-            'success': True,
-            'requests': result
-        }), 200
+            'success': False,
+            'status': 'starting' if schema_state['error'] is None else 'error',
+            'message': schema_state['error']
+        }), 503
 
+    try:
+        for index in range(app.config['SHARD_COUNT']):
+            get_shard_db(index).execute('SELECT 1').fetchone()
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'status': 'error', 'message': str(e)}), 503
+
+    return jsonify({'success': True, 'status': 'ok', 'schema_version': schema_state['version']}), 200
+
+@app.route('/api/admin/snapshot', methods=['POST'])
+@require_admin
+def create_snapshot():
+    """Онлайн-снимок базы (всех шардов) в SNAPSHOT_DIR без остановки сервера"""
+    try:
+        # Пути на диске сервера клиенту не сообщаются — только имя файла в SNAPSHOT_DIR
+        snapshots = [{
+            'name': os.path.basename(path),
+            'size': os.path.getsize(path),
+            'created_at': datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        } for path in take_snapshots()]
     except sqlite3.Error as e:
         return jsonify({'success': False, 'message': f'Ошибка базы данных: {str(e)}'}), 500
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Неизвестная ошибка: {str(e)}'}), 500
-    finally:
-        if conn:
-            conn.close()
+    except OSError as e:
+        return jsonify({'success': False, 'message': f'Ошибка записи снимка: {str(e)}'}), 500
+    return jsonify({'success': True, 'snapshots': snapshots}), 201
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+metrics.registry.gauge('identity_cache_entries', lambda: len(identity_cache), 'Записей в кэше пользователей')
+metrics.registry.gauge('token_cache_entries', lambda: len(token_cache), 'Записей в кэше проверенных токенов')
+metrics.registry.gauge('db_pool_idle_connections', lambda: get_pool().idle_count(), 'Свободных соединений в пуле')
+metrics.registry.gauge('db_read_pool_idle_connections', lambda: get_read_pool().idle_count(), 'Свободных соединений в пуле чтения')
+metrics.registry.gauge('write_queue_pending', lambda: sum(writer.pending() for writer in list(_writers.values())),
+                       'Операций записи в очередях писателей')
+metrics.registry.gauge('auth_requests_in_flight', lambda: auth_concurrency.active, 'Одновременных запросов входа и регистрации')
+
+def _by_database(values):
+    return {(('db', os.path.basename(path)),): value for path, value in values.items()}
+
+metrics.registry.gauge('db_wal_size_bytes', lambda: _by_database({path: wal_size(path) for path in database_files()}),
+                       'Размер файла WAL')
+metrics.registry.gauge('db_wal_checkpoint_lag_frames', lambda: _by_database(wal_maintenance.lag()),
+                       'Кадров WAL, не перенесенных последней контрольной точкой')
+metrics.registry.gauge('db_wal_checkpoint_age_seconds', lambda: _by_database(wal_maintenance.age()),
+                       'Секунд с контрольной точки, перенесшей весь WAL')
 
 # ======================
 # Запуск сервера
 # ======================
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сервер заявок')
+    parser.add_argument('--asgi', action='store_true',
+                        help='асинхронный режим (asgi.py под uvicorn): long-poll и SSE не занимают потоки')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
     init_db()  # Инициализация базы данных
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    if args.asgi:
+        try:
+            import uvicorn
+        except ImportError:
+            sys.exit('Для --asgi нужен uvicorn: pip install uvicorn')
+        # asgi.py импортирует MainServer — пусть получит этот модуль, а не вторую копию
+        sys.modules.setdefault('MainServer', sys.modules[__name__])
+        from asgi import application
+        uvicorn.run(application, host=args.host, port=args.port)
+    else:
+        app.run(host=args.host, port=args.port, debug=False)
\ No newline at end of file
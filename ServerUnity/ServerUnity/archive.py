@@ -0,0 +1,84 @@
+"""
+Перенос завершенных заявок из requests в requests_archive.
+
+Заявки в конечных статусах старше заданного возраста переносятся
+небольшими пачками в фоновом потоке, поэтому рабочая таблица и ее
+индексы содержат только актуальные заявки. Каждая пачка — одна
+транзакция: копирование в архив и удаление из requests. Триггеры
+requests при удалении обновляют версии списков (ETag), убирают заявку
+из полнотекстового индекса и пишут в ленту изменений операцию 'archive'.
+"""
+import json
+import threading
+
+from migrations import REQUEST_ROW_COLUMNS
+
+
+def archive_batch(conn, statuses, min_age_seconds, limit):
+    """Переносит в архив до limit заявок; возвращает число перенесенных"""
+    placeholders = ', '.join('?' for _ in statuses)
+    ids = [row[0] for row in conn.execute(
+        f'''SELECT id FROM requests
+            WHERE status IN ({placeholders}) AND created_at < datetime('now', ?)
+            ORDER BY created_at LIMIT ?''',
+        (*statuses, f'-{int(min_age_seconds)} seconds', limit)
+    )]
+    if not ids:
+        return 0
+
+    ids_json = json.dumps(ids)
+    # Не INSERT OR REPLACE: при замене триггеры удаления архива не срабатывают
+    conn.execute('DELETE FROM requests_archive WHERE id IN (SELECT value FROM json_each(?))', (ids_json,))
+    conn.execute(
+        f'''INSERT INTO requests_archive ({REQUEST_ROW_COLUMNS})
+            SELECT {REQUEST_ROW_COLUMNS} FROM requests WHERE id IN (SELECT value FROM json_each(?))''',
+        (ids_json,)
+    )
+    conn.execute('DELETE FROM requests WHERE id IN (SELECT value FROM json_each(?))', (ids_json,))
+    return len(ids)
+
+
+class Archiver:
+    """
+    Фоновый поток архивации. run_batch() переносит одну пачку и возвращает
+    число перенесенных строк; пока пачки полные, следующая идет после
+    короткой паузы, иначе поток спит interval секунд
+    """
+
+    def __init__(self, run_batch, batch_size, interval=60, pause=0.05, on_error=None):
+        self._run_batch = run_batch
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause
+        self._on_error = on_error
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='archiver', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_once(self):
+        """Переносит все подходящие заявки; возвращает их число"""
+        total = 0
+        while not self._stop.is_set():
+            moved = self._run_batch()
+            total += moved
+            if moved < self.batch_size or self._stop.wait(self.pause):
+                break
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                if self._on_error is not None:
+                    self._on_error(e)
@@ -0,0 +1,347 @@
+"""
+Асинхронный (ASGI) режим сервера.
+
+Лента изменений (/api/changes и /api/changes/stream) обслуживается
+в цикле asyncio: ожидающий клиент не занимает поток, поэтому один
+процесс держит тысячи long-poll и SSE соединений. Короткие чтения
+базы выполняются в отдельном пуле потоков.
+
+Остальные маршруты с тем же JSON-контрактом обрабатывает Flask-приложение
+MainServer в пуле из ASGI_WSGI_THREADS потоков. Такой запрос занимает поток
+целиком, включая ожидание: /api/login и /api/register держат поток, пока
+пул PasswordHasher считает bcrypt, запись ждет коммита потока-писателя.
+Поэтому для этих маршрутов ASGI-режим не увеличивает параллельность —
+ее ограничивает ASGI_WSGI_THREADS (а вход и регистрацию еще
+AUTH_MAX_CONCURRENCY). Сторонних зависимостей нет, кроме ASGI-сервера.
+
+Запуск:
+    python MainServer.py --asgi
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import io
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from flask import g, request
+
+import MainServer as server
+import metrics
+
+# Маршруты, обслуживаемые без выделенного потока: путь -> True для SSE
+NATIVE_ROUTES = {'/api/changes': False, '/api/changes/stream': True}
+
+# Частей ответа, ожидающих отправки клиенту
+RESPONSE_QUEUE_SIZE = 8
+
+_END = object()
+
+
+class _Abandoned(Exception):
+    """Клиент отключился — дальше тело ответа не читаем"""
+
+
+def build_environ(scope, body):
+    """WSGI environ из HTTP-запроса ASGI"""
+    host, port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': host,
+        'SERVER_PORT': str(port),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').lower()
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+class AsyncChangeWaiter:
+    """
+    Асинхронный аналог ChangeFeed.wait: notify() из любого потока
+    будит ожидающие корутины через call_soon_threadsafe
+    """
+
+    def __init__(self, feed, loop):
+        self.feed = feed
+        self.loop = loop
+        self._version = 0
+        self._event = asyncio.Event()
+        feed.add_listener(self._notify_threadsafe)
+
+    def _notify_threadsafe(self):
+        try:
+            self.loop.call_soon_threadsafe(self._bump)
+        except RuntimeError:  # цикл уже закрыт
+            self.feed.remove_listener(self._notify_threadsafe)
+
+    def _bump(self):
+        self._version += 1
+        self._event.set()
+        self._event = asyncio.Event()
+
+    def close(self):
+        self.feed.remove_listener(self._notify_threadsafe)
+
+    async def wait(self, fetch, timeout):
+        """Ждет, пока await fetch() не вернет непустой список или не истечет timeout"""
+        deadline = self.loop.time() + timeout
+        while True:
+            seen, event = self._version, self._event
+            changes = await fetch()
+            if changes:
+                return changes
+
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return []
+            if self._version == seen:
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, self.feed.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+
+
+class ASGIApplication:
+    """ASGI-приложение поверх MainServer.app"""
+
+    def __init__(self, module):
+        self.server = module
+        self.app = module.app
+        self.executor = ThreadPoolExecutor(self.app.config['ASGI_WSGI_THREADS'], thread_name_prefix='asgi-wsgi')
+        self.db_executor = ThreadPoolExecutor(self.app.config['ASGI_DB_THREADS'], thread_name_prefix='asgi-db')
+        self.waiter = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            body = await self.read_body(receive)
+            stream = NATIVE_ROUTES.get(scope['path'])
+            if stream is not None and scope['method'] == 'GET':
+                await self.serve_changes(scope, body, receive, send, stream)
+            else:
+                await self.serve_wsgi(scope, body, send)
+        else:
+            raise RuntimeError(f'Неподдерживаемый тип соединения: {scope["type"]}')
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await loop.run_in_executor(self.db_executor, self.server.init_db)
+                except sqlite3.Error as e:
+                    # Как и под WSGI: ensure_schema_ready повторит попытку на первом запросе
+                    print(f'База данных не готова: {e}', file=sys.stderr)
+                self.get_waiter()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.waiter is not None:
+                    self.waiter.close()
+                self.server.shutdown()
+                self.executor.shutdown(wait=False)
+                self.db_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def get_waiter(self):
+        if self.waiter is None:
+            self.waiter = AsyncChangeWaiter(self.server.change_feed, asyncio.get_running_loop())
+        return self.waiter
+
+    @staticmethod
+    async def read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    # ----- Остальные маршруты: Flask в пуле потоков -----
+
+    async def serve_wsgi(self, scope, body, send):
+        """
+        Вызов приложения, перебор тела ответа и close() выполняются в одном
+        потоке пула: соединения ConnectionPool закреплены за потоком, и release()
+        из другого потока не вернул бы их в пул. Части ответа передаются
+        в цикл событий через ограниченную очередь
+        """
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, body)
+        started = {}
+        chunks = asyncio.Queue(RESPONSE_QUEUE_SIZE)
+        abandoned = threading.Event()
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        def put(item):
+            # Ждем места в очереди, пока клиент не отключился
+            future = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+            while True:
+                try:
+                    return future.result(0.1)
+                except FutureTimeout:
+                    if abandoned.is_set():
+                        future.cancel()
+                        raise _Abandoned()
+
+        def produce():
+            result = None
+            try:
+                result = self.app(environ, start_response)
+                for chunk in result:
+                    if chunk:
+                        put(chunk)
+                put(_END)
+            except _Abandoned:
+                pass
+            except BaseException as e:
+                if not abandoned.is_set():
+                    put((_END, e))
+            finally:
+                close = getattr(result, 'close', None)
+                if close is not None:
+                    close()
+
+        producer = loop.run_in_executor(self.executor, produce)
+        try:
+            chunk = await self.next_chunk(chunks)
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': encode_headers(started['headers'])})
+            # Потоковые ответы (?stream=ndjson) отдаются по мере генерации
+            while chunk is not _END:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await self.next_chunk(chunks)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            abandoned.set()
+            await asyncio.wait([producer])
+
+    @staticmethod
+    async def next_chunk(chunks):
+        chunk = await chunks.get()
+        if isinstance(chunk, tuple):
+            raise chunk[1]
+        return chunk
+
+    # ----- Лента изменений: ожидание без потока -----
+
+    def prepare_changes(self, environ, stream):
+        """
+        Проверка токена и параметров теми же функциями, что и в WSGI-режиме.
+        Возвращает (None, параметры ожидания, маршрут) или (готовый ответ, None, маршрут)
+        """
+        app = self.app
+        with app.request_context(environ):
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = self.server.require_auth(self.server.prepare_changes)(stream)
+                if rv is None:
+                    return None, g.changes_wait, route
+                response = app.process_response(app.make_response(rv))
+            except Exception as e:
+                response = app.make_response(app.handle_exception(e))
+            return (response.status_code, response.headers.to_wsgi_list(), response.get_data()), None, route
+
+    async def serve_changes(self, scope, body, receive, send, stream):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        ready, params, route = await loop.run_in_executor(
+            self.db_executor, self.prepare_changes, build_environ(scope, body), stream
+        )
+        if ready is not None:
+            status, headers, payload = ready
+            await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+            await send({'type': 'http.response.body', 'body': payload})
+            return
+
+        since, request_id, user_id, timeout, current = params
+        waiter = self.get_waiter()
+
+        def fetch(position):
+            return loop.run_in_executor(self.db_executor, self.server.read_changes, position, request_id, user_id)
+
+        if stream:
+            status = await self.stream_changes(send, receive, waiter, fetch, since)
+        else:
+            try:
+                changes = await waiter.wait(lambda: fetch(since), timeout)
+                status, payload = 200, self.server.changes_payload(since, current, changes)
+            except sqlite3.Error as e:
+                status, payload = 500, {'success': False, 'message': f'Ошибка базы данных: {str(e)}'}
+            # Тот же формат, что у jsonify
+            with self.app.app_context():
+                response = self.app.json.response(payload)
+            await send({'type': 'http.response.start', 'status': status,
+                        'headers': encode_headers(response.headers.to_wsgi_list())})
+            await send({'type': 'http.response.body', 'body': response.get_data()})
+
+        metrics.registry.observe('http_request_duration_seconds', time.perf_counter() - started,
+                                 route=route, method='GET')
+        metrics.registry.inc('http_requests_total', route=route, method='GET', status=status)
+
+    async def stream_changes(self, send, receive, waiter, fetch, since):
+        config = self.app.config
+        headers = [('Content-Type', 'text/event-stream; charset=utf-8')] + list(self.server.SSE_HEADERS.items())
+        await send({'type': 'http.response.start', 'status': 200, 'headers': encode_headers(headers)})
+
+        # Тело запроса уже прочитано — следующее сообщение придет при обрыве соединения
+        disconnected = asyncio.ensure_future(receive())
+        position = since
+        deadline = time.monotonic() + config['CHANGES_STREAM_MAX_AGE']
+        try:
+            await send({'type': 'http.response.body', 'body': f'retry: 3000\nid: {position}\n\n'.encode(),
+                        'more_body': True})
+            while time.monotonic() < deadline and not disconnected.done():
+                changes = await waiter.wait(lambda: fetch(position), config['CHANGES_STREAM_HEARTBEAT'])
+                if not changes:
+                    await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                    continue
+                events = ''.join(self.server.change_event(change) for change in changes)
+                await send({'type': 'http.response.body', 'body': events.encode('utf-8'), 'more_body': True})
+                position = changes[-1]['seq']
+        finally:
+            disconnected.cancel()
+        await send({'type': 'http.response.body', 'body': b''})
+        return 200
+
+
+application = ASGIApplication(server)
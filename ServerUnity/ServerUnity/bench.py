@@ -0,0 +1,314 @@
+"""
+Нагрузочный бенчмарк API.
+
+Создает временную users.db с N пользователями и M заявками, поднимает
+приложение (тестовый клиент Flask или локальный WSGI-сервер) и гоняет
+смесь реальных запросов: вход, опрос /api/requests/<id>, список
+/api/requestsByUserID, смена статуса администратором.
+Результат — JSON с p50/p95/p99, пропускной способностью и пиковым RSS.
+
+Пример:
+    python bench.py --users 200 --requests 20000 --duration 30 --concurrency 16 --output bench.json
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_PASSWORD = 'bench-password'
+STATUSES = ['Pending', 'Accepted', 'Rejected', 'Completed']
+
+# Маршрут -> вес в смеси запросов
+DEFAULT_MIX = {
+    'login': 5,
+    'poll_request': 60,
+    'list_by_user': 25,
+    'admin_accept': 10,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк задержек и пропускной способности API')
+    parser.add_argument('--users', type=int, default=100, help='число пользователей в тестовой базе')
+    parser.add_argument('--requests', type=int, default=10000, help='число заявок в тестовой базе')
+    parser.add_argument('--duration', type=float, default=10, help='длительность нагрузки, секунд')
+    parser.add_argument('--concurrency', type=int, default=8, help='число параллельных клиентов')
+    parser.add_argument('--server', choices=['inprocess', 'wsgi'], default='inprocess',
+                        help='inprocess — тестовый клиент Flask, wsgi — локальный HTTP-сервер')
+    parser.add_argument('--bcrypt-rounds', type=int, default=4,
+                        help='work factor bcrypt для тестовых пользователей')
+    parser.add_argument('--mix', default=None,
+                        help='веса маршрутов, например login=5,poll_request=60,list_by_user=25,admin_accept=10')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help='файл для JSON-отчета (по умолчанию stdout)')
+    parser.add_argument('--keep-db', action='store_true', help='не удалять временную базу')
+    return parser.parse_args(argv)
+
+
+def parse_mix(value):
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in value.split(','):
+        name, weight = part.split('=')
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f'Неизвестный маршрут в --mix: {name}')
+        mix[name] = int(weight)
+    return mix
+
+
+def seed_database(server, users, requests, rng):
+    """Заполняет базу тестовыми данными; первый пользователь — администратор"""
+    server.init_db()
+    hashed = server.hash_password(BENCH_PASSWORD)
+    with server.get_pool().connection() as conn:
+        conn.executemany(
+            'INSERT INTO users (username, email, password, is_partner) VALUES (?, ?, ?, ?)',
+            ((f'bench_user_{i}', f'bench_user_{i}@bench.local', hashed, 1 if i == 0 else 0)
+             for i in range(users))
+        )
+        conn.commit()
+
+    # Заявка с id = i + 1 достается владельцу из шарда, на который указывает id
+    # (id шарда сравнимы с его номером); при одном шарде владелец случайный
+    count = server.app.config['SHARD_COUNT']
+    by_shard = {}
+    for i in range(requests):
+        content = 'Текст заявки ' * rng.randint(5, 50)
+        status = rng.choice(STATUSES)
+        user_id = rng.randint(1, users)
+        user_id -= (user_id - i - 1) % count
+        if user_id < 1:
+            user_id += count
+        row = (i + 1, f'Заявка {i}', content, status, user_id, f'-{requests - i} seconds')
+        by_shard.setdefault(server.user_shard(user_id), []).append(row)
+    for index, rows in by_shard.items():
+        with server.get_shard_pool(index).connection() as conn:
+            conn.executemany(
+                '''INSERT INTO requests (id, title, content, status, user_id, created_at)
+                   VALUES (?, ?, ?, ?, ?, datetime('now', ?))''',
+                rows
+            )
+            conn.commit()
+            conn.execute('ANALYZE')
+
+
+class InProcessClient:
+    """Запросы через тестовый клиент Flask (без сети)"""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self._client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPClient:
+    """Запросы к локальному WSGI-серверу по HTTP"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def request(self, method, path, body=None, token=None):
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        finally:
+            conn.close()
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+def start_wsgi_server(app):
+    """Поднимает многопоточный WSGI-сервер на свободном порту"""
+    from werkzeug.serving import make_server
+
+    httpd = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
+
+
+def percentile(sorted_values, pct):
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, errors):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'mean_ms': round(sum(samples) / len(samples), 3) if samples else None,
+        'p50_ms': round(percentile(samples, 50), 3) if samples else None,
+        'p95_ms': round(percentile(samples, 95), 3) if samples else None,
+        'p99_ms': round(percentile(samples, 99), 3) if samples else None,
+        'max_ms': round(samples[-1], 3) if samples else None,
+    }
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS возвращает байты, Linux — килобайты
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def worker(client, worker_id, args, mix, deadline, results, lock):
+    rng = random.Random(args.seed + worker_id)
+    username = f'bench_user_{worker_id % args.users}'
+    admin_token = None
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    local = {name: ([], 0) for name in names}
+
+    def timed(name, method, path, body=None, token=None):
+        started = time.perf_counter()
+        status, data = client.request(method, path, body, token)
+        elapsed = (time.perf_counter() - started) * 1000
+        samples, errors = local[name]
+        samples.append(elapsed)
+        if status >= 400:
+            local[name] = (samples, errors + 1)
+        return status, data
+
+    status, data = client.request('POST', '/api/login',
+                                  {'username': username, 'password': BENCH_PASSWORD})
+    token = data.get('token') if data else None
+    if 'admin_accept' in mix:
+        status, data = client.request('POST', '/api/login',
+                                      {'username': 'bench_user_0', 'password': BENCH_PASSWORD})
+        admin_token = data.get('token') if data else None
+
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        request_id = rng.randint(1, args.requests)
+        if name == 'login':
+            timed(name, 'POST', '/api/login', {'username': username, 'password': BENCH_PASSWORD})
+        elif name == 'poll_request':
+            timed(name, 'GET', f'/api/requests/{request_id}', token=token)
+        elif name == 'list_by_user':
+            timed(name, 'GET', '/api/requestsByUserID', token=token)
+        elif name == 'admin_accept':
+            timed(name, 'PATCH', f'/api/requestsAdminAccept/{request_id}',
+                  {'status': rng.choice(STATUSES)}, token=admin_token)
+
+    with lock:
+        for name, (samples, errors) in local.items():
+            all_samples, all_errors = results.setdefault(name, ([], 0))
+            all_samples.extend(samples)
+            results[name] = (all_samples, all_errors + errors)
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    os.environ['DATABASE'] = os.path.join(workdir, 'users.db')
+    os.environ['BCRYPT_ROUNDS'] = str(args.bcrypt_rounds)
+    # Все клиенты бенчмарка идут с одного адреса — лимиты входа исказили бы замер
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import MainServer as server
+
+    rng = random.Random(args.seed)
+    try:
+        started = time.perf_counter()
+        seed_database(server, args.users, args.requests, rng)
+        seed_seconds = time.perf_counter() - started
+
+        httpd = None
+        if args.server == 'wsgi':
+            httpd = start_wsgi_server(server.app)
+            make_client = lambda: HTTPClient('127.0.0.1', httpd.server_port)
+        else:
+            make_client = lambda: InProcessClient(server.app)
+
+        results = {}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.duration
+        load_started = time.perf_counter()
+        threads = [
+            threading.Thread(target=worker, args=(make_client(), i, args, mix, deadline, results, lock))
+            for i in range(args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - load_started
+
+        if httpd is not None:
+            httpd.shutdown()
+
+        all_samples = [s for samples, _ in results.values() for s in samples]
+        all_errors = sum(errors for _, errors in results.values())
+        return {
+            'config': {
+                'users': args.users,
+                'requests': args.requests,
+                'duration_s': args.duration,
+                'concurrency': args.concurrency,
+                'server': args.server,
+                'bcrypt_rounds': args.bcrypt_rounds,
+                'mix': mix,
+            },
+            'seed_s': round(seed_seconds, 3),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(all_samples) / elapsed, 2) if elapsed else None,
+            'total': summarize(all_samples, all_errors),
+            'routes': {name: summarize(samples, errors) for name, (samples, errors) in sorted(results.items())},
+            'peak_rss_kb': peak_rss_kb(),
+        }
+    finally:
+        server.shutdown()
+        if args.keep_db:
+            print(f'База сохранена: {workdir}', file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Отладочный вывод сервера не должен смешиваться с JSON-отчетом
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run(args)
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
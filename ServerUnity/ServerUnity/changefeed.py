@@ -0,0 +1,89 @@
+"""
+Лента изменений заявок.
+
+Каждая вставка/изменение/удаление строки requests получает номер seq
+в таблице request_changes (пишется триггерами, см. migrations.py).
+Клиент ждет изменений после известного ему seq вместо периодического
+перезапроса заявки.
+"""
+import threading
+import time
+
+
+def latest_seq(conn):
+    """Последний номер изменения"""
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM request_changes').fetchone()[0]
+
+
+def oldest_seq(conn):
+    """Самый старый сохраненный номер изменения (старые удаляются)"""
+    return conn.execute('SELECT MIN(seq) FROM request_changes').fetchone()[0]
+
+
+def fetch_changes(conn, since, request_id=None, user_id=None, limit=100):
+    """Изменения после seq since, отфильтрованные по заявке и/или пользователю"""
+    query = 'SELECT seq, request_id, user_id, op FROM request_changes WHERE seq > ?'
+    params = [since]
+    if request_id is not None:
+        query += ' AND request_id = ?'
+        params.append(request_id)
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    query += ' ORDER BY seq LIMIT ?'
+    params.append(limit)
+    return [
+        {'seq': row[0], 'request_id': row[1], 'user_id': row[2], 'op': row[3]}
+        for row in conn.execute(query, params).fetchall()
+    ]
+
+
+class ChangeFeed:
+    """
+    Ожидание изменений без активного опроса.
+    Обработчики вызывают notify() после коммита — ждущие потоки
+    просыпаются сразу. Изменения из других процессов замечаются
+    проверкой раз в poll_interval секунд.
+    """
+
+    def __init__(self, poll_interval=2.0):
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._version = 0
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback() вызывается при каждом notify() — для ожидающих вне потоков (asyncio)"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def notify(self):
+        """Сообщает ждущим, что в базе появились изменения"""
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+        for callback in list(self._listeners):
+            callback()
+
+    def wait(self, fetch, timeout):
+        """
+        Блокируется, пока fetch() не вернет непустой список или не истечет timeout.
+        fetch() должна сама брать и отпускать соединение с базой
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                seen = self._version
+            changes = fetch()
+            if changes:
+                return changes
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            with self._cond:
+                if self._version == seen:
+                    self._cond.wait(min(remaining, self.poll_interval))
@@ -0,0 +1,61 @@
+"""
+Сжатие ответов gzip/brotli по заголовку Accept-Encoding.
+
+brotli — необязательная зависимость (pip install brotli); без нее
+используется только gzip. Потоковые ответы сжимаются по частям
+с flush после каждой части, чтобы клиент получал данные без задержки.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Типы содержимого, которые имеет смысл сжимать
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html')
+
+
+def available_encodings():
+    """Поддерживаемые кодировки в порядке предпочтения"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    """Лучшая кодировка из Accept-Encoding (werkzeug MIMEAccept/Accept) или None"""
+    return accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding, level):
+    """Сжимает bytes целиком"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    # wbits=31 — формат gzip (заголовок и CRC), а не «голый» deflate
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, level):
+    """Сжимает итератор частей ответа, отдавая сжатые данные после каждой части"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        process = lambda chunk: compressor.process(chunk) + compressor.flush()
+        finish = compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        process = lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        finish = compressor.flush
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = process(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        # Исходный генератор может держать соединение с базой
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,164 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+
+def open_connection(path, timeout=30, factory=sqlite3.Connection, read_only=False, cache_size_kb=None, mmap_size=None):
+    """
+    Открывает соединение с общими для сервера PRAGMA.
+    read_only — соединение только для чтения (mode=ro и query_only):
+    в режиме WAL такие читатели не мешают писателю и друг другу
+    """
+    if read_only:
+        uri = f'file:{pathname2url(os.path.abspath(path))}?mode=ro'
+        conn = sqlite3.connect(uri, timeout=timeout, check_same_thread=False, factory=factory, uri=True)
+        conn.execute('PRAGMA query_only=1')
+    else:
+        conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, factory=factory)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={int(timeout * 1000)}')
+    if cache_size_kb:
+        # Отрицательное значение — размер кэша страниц в килобайтах
+        conn.execute(f'PRAGMA cache_size=-{int(cache_size_kb)}')
+    if mmap_size:
+        conn.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+    return conn
+
+
+class ConnectionPool:
+    """
+    Пул долгоживущих соединений с SQLite.
+
+    PRAGMA (WAL, busy_timeout, synchronous=NORMAL) применяются один раз при
+    открытии соединения. Пока поток держит соединение, повторные acquire()
+    в этом же потоке возвращают его же, а не открывают второе.
+    С read_only=True пул выдает соединения только для чтения (см. open_connection).
+    """
+
+    def __init__(self, path, size=16, timeout=30, health_check_interval=60, factory=sqlite3.Connection,
+                 read_only=False, cache_size_kb=None, mmap_size=None):
+        self.path = path
+        self.factory = factory
+        self.read_only = read_only
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+
+    def _open(self):
+        """Открывает новое соединение и настраивает его"""
+        return open_connection(self.path, self.timeout, self.factory,
+                               self.read_only, self.cache_size_kb, self.mmap_size)
+
+    def _is_alive(self, conn):
+        """Проверка соединения перед повторным использованием"""
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _take_idle(self):
+        """Берет свободное соединение из пула, отбрасывая неисправные"""
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if time.monotonic() - released_at < self.health_check_interval or self._is_alive(conn):
+                return conn
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def acquire(self):
+        """Выдает соединение, закрепленное за текущим потоком"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.depth += 1
+            return conn
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError('Пул соединений исчерпан')
+        try:
+            conn = self._take_idle() or self._open()
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn):
+        """Возвращает соединение в пул, когда поток перестает его использовать"""
+        if getattr(self._local, 'conn', None) is not conn:
+            return
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+
+        self._local.conn = None
+        try:
+            # Незавершенная транзакция не должна попасть к следующему владельцу
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put((conn, time.monotonic()))
+        except sqlite3.Error:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        finally:
+            self._slots.release()
+
+    def idle_count(self):
+        """Число свободных (открытых, но не выданных) соединений"""
+        return self._idle.qsize()
+
+    def warm(self, count, statements=()):
+        """
+        Заранее открывает соединения, чтобы в пуле было не меньше count
+        свободных, и выполняет на каждом statements — [(sql, params)]:
+        схема разбирается и выражения попадают в кэш соединения до первого запроса
+        """
+        for _ in range(count - self.idle_count()):
+            conn = self._open()
+            try:
+                for sql, params in statements:
+                    conn.execute(sql, params).fetchall()
+            except sqlite3.Error:
+                conn.close()
+                raise
+            self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: with pool.connection() as conn"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Закрывает все свободные соединения"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
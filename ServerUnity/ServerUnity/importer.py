@@ -0,0 +1,309 @@
+"""
+Импорт пользователей и заявок из базы старой схемы (например, oldUser.db).
+
+Источник читается потоком (fetchmany), вставка идет через executemany
+большими транзакциями. Пользователи получают новые id, заявки переносятся
+с переназначенным user_id (и в шард нового владельца). Прогресс
+сохраняется в той же транзакции, что и данные. Поэтому прерванный импорт
+продолжается с места остановки при повторном запуске с теми же параметрами.
+
+Конфликт имени или email с существующим пользователем (--on-conflict):
+    merge  — это тот же человек: заявки переносятся к найденному
+             пользователю (по имени, иначе по email). По умолчанию
+    skip   — пользователь и его заявки не импортируются
+    rename — создается новый пользователь, к имени и email
+             добавляется суффикс (--rename-suffix)
+
+Колонки is_partner в старой схеме нет — такие пользователи получают 0.
+
+Пример:
+    python importer.py oldUser.db --database users.db --batch-size 20000 --defer-indexes
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from db_pool import open_connection
+from migrations import REQUEST_INDEXES, create_request_indexes
+from shards import next_request_id, shard_of, shard_path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Импорт пользователей и заявок из базы старой схемы')
+    parser.add_argument('source', help='файл старой базы, например oldUser.db')
+    parser.add_argument('--database', default=os.environ.get('DATABASE', 'users.db'),
+                        help='база сервера, в которую идет импорт')
+    parser.add_argument('--batch-size', type=int, default=5000, help='строк в одной транзакции')
+    parser.add_argument('--on-conflict', choices=['merge', 'skip', 'rename'], default='merge',
+                        help='что делать с пользователем, чье имя или email уже занято')
+    parser.add_argument('--rename-suffix', default='.old{id}',
+                        help='суффикс имени и email для --on-conflict rename ({id} — старый id)')
+    parser.add_argument('--source-name', default=None,
+                        help='ключ прогресса импорта (по умолчанию — полный путь к источнику)')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='удалить вторичные индексы requests на время загрузки и построить заново в конце')
+    parser.add_argument('--report-interval', type=float, default=5, help='период вывода скорости, секунд')
+    return parser.parse_args(argv)
+
+
+class Progress:
+    """Счетчик прочитанных строк источника; скорость выводится не чаще раза в interval секунд"""
+
+    def __init__(self, stage, last_id, interval):
+        self.stage = stage
+        self.last_id = last_id
+        self.interval = interval
+        self.rows = 0
+        self.started = self._reported = time.perf_counter()
+
+    def add(self, rows, last_id):
+        self.rows += rows
+        self.last_id = last_id
+        now = time.perf_counter()
+        if now - self._reported >= self.interval:
+            self._reported = now
+            self.report()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def report(self):
+        print(f'{self.stage}: {self.rows} строк за этот запуск, {self.rate():.0f} строк/с, '
+              f'последний id {self.last_id}', file=sys.stderr)
+
+
+def get_progress(conn, source, stage):
+    """(последний обработанный id источника, число строк) этапа импорта"""
+    row = conn.execute(
+        'SELECT last_id, rows FROM import_progress WHERE source = ? AND stage = ?', (source, stage)
+    ).fetchone()
+    return row if row else (0, 0)
+
+
+def save_progress(conn, source, stage, last_id, rows):
+    conn.execute('''
+        INSERT INTO import_progress (source, stage, last_id, rows) VALUES (?, ?, ?, ?)
+        ON CONFLICT(source, stage) DO UPDATE SET last_id = excluded.last_id, rows = rows + excluded.rows
+    ''', (source, stage, last_id, rows))
+
+
+def has_column(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_info({table})'))
+
+
+def import_user_batch(conn, rows, policy, suffix, stats):
+    """
+    Вставляет пачку пользователей старой схемы.
+    Возвращает ({старый id: новый id или None}, имена затронутых пользователей)
+    """
+    # Занятые имена и email — одним запросом на пачку
+    by_username, by_email = {}, {}
+    for user_id, username, email in conn.execute(
+        '''SELECT id, username, email FROM users
+           WHERE username IN (SELECT value FROM json_each(?)) OR email IN (SELECT value FROM json_each(?))''',
+        (json.dumps([row[1] for row in rows]), json.dumps([row[2] for row in rows]))
+    ):
+        by_username[username] = user_id
+        by_email[email] = user_id
+
+    mapping, touched, inserts, renames = {}, [], [], []
+    for old_id, username, email, password, created_at, is_partner in rows:
+        existing = by_username.get(username) or by_email.get(email)
+        if existing is None:
+            inserts.append((old_id, username, email, password, created_at, is_partner))
+        elif policy == 'merge':
+            mapping[old_id] = existing
+            touched.append(username)
+            stats['merged'] += 1
+        elif policy == 'rename':
+            tag = suffix.format(id=old_id)
+            renames.append((old_id, username + tag, email + tag, password, created_at, is_partner))
+        else:
+            mapping[old_id] = None
+            stats['skipped'] += 1
+
+    insert = '''INSERT INTO users (username, email, password, created_at, is_partner)
+                VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)'''
+    if inserts:
+        conn.executemany(insert, (row[1:] for row in inserts))
+        new_ids = dict(conn.execute(
+            'SELECT username, id FROM users WHERE username IN (SELECT value FROM json_each(?))',
+            (json.dumps([row[1] for row in inserts]),)
+        ))
+        for row in inserts:
+            mapping[row[0]] = new_ids[row[1]]
+            touched.append(row[1])
+        stats['imported'] += len(inserts)
+
+    # Переименованных немного — по одному, чтобы занятый суффикс не сорвал всю пачку
+    for row in renames:
+        try:
+            mapping[row[0]] = conn.execute(insert, row[1:]).lastrowid
+            touched.append(row[1])
+            stats['renamed'] += 1
+        except sqlite3.IntegrityError:
+            mapping[row[0]] = None
+            stats['skipped'] += 1
+    return mapping, touched
+
+
+def import_users(server, source, target, source_key, args):
+    """Этап users: пачки пользователей и соответствие id в import_user_map"""
+    stats = {'imported': 0, 'merged': 0, 'renamed': 0, 'skipped': 0}
+    last_id, _ = get_progress(target, source_key, 'users')
+    is_partner = 'is_partner' if has_column(source, 'users', 'is_partner') else '0'
+    cursor = source.execute(
+        f'SELECT id, username, email, password, created_at, {is_partner} FROM users WHERE id > ? ORDER BY id',
+        (last_id,)
+    )
+    progress = Progress('users', last_id, args.report_interval)
+    while True:
+        rows = cursor.fetchmany(args.batch_size)
+        if not rows:
+            break
+
+        target.execute('BEGIN IMMEDIATE')
+        try:
+            mapping, touched = import_user_batch(target, rows, args.on_conflict, args.rename_suffix, stats)
+            target.executemany(
+                'INSERT OR REPLACE INTO import_user_map (source, old_id, new_id) VALUES (?, ?, ?)',
+                ((source_key, old_id, new_id) for old_id, new_id in mapping.items())
+            )
+            save_progress(target, source_key, 'users', rows[-1][0], len(rows))
+            target.commit()
+        except BaseException:
+            target.rollback()
+            raise
+
+        for username in touched:
+            server.invalidate_user(username)
+        progress.add(len(rows), rows[-1][0])
+    progress.report()
+    stats['rate'] = progress.rate()
+    return stats
+
+
+def import_requests(server, source, targets, source_key, args):
+    """
+    Этап requests: заявки с новыми user_id. У каждого шарда свой прогресс
+    в его же базе — пачка шарда и отметка о ней фиксируются одним коммитом
+    """
+    count = len(targets)
+    stats = {'imported': 0, 'skipped': 0}
+    last = [get_progress(conn, source_key, 'requests')[0] for conn in targets]
+
+    cursor = source.execute(
+        'SELECT id, title, content, status, created_at, user_id FROM requests WHERE id > ? ORDER BY id',
+        (min(last),)
+    )
+    progress = Progress('requests', min(last), args.report_interval)
+    while True:
+        rows = cursor.fetchmany(args.batch_size)
+        if not rows:
+            break
+
+        user_map = dict(targets[0].execute(
+            'SELECT old_id, new_id FROM import_user_map WHERE source = ? AND old_id IN (SELECT value FROM json_each(?))',
+            (source_key, json.dumps(list({row[5] for row in rows if row[5] is not None})))
+        ))
+        by_shard = [[] for _ in range(count)]
+        for old_id, title, content, status, created_at, old_user_id in rows:
+            user_id = user_map.get(old_user_id) if old_user_id is not None else None
+            if old_user_id is not None and user_id is None:
+                # Владелец пропущен или отсутствует в источнике
+                stats['skipped'] += 1
+                continue
+            index = shard_of(user_id, count)
+            if old_id > last[index]:
+                by_shard[index].append((title, content, status, created_at, user_id))
+
+        for index, conn in enumerate(targets):
+            shard_rows = by_shard[index]
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if count == 1:
+                    conn.executemany(
+                        '''INSERT INTO requests (title, content, status, created_at, user_id)
+                           VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)''',
+                        shard_rows
+                    )
+                elif shard_rows:
+                    # id шарда сравнимы с его номером (см. shards.py)
+                    first_id = next_request_id(conn, index, count)
+                    conn.executemany(
+                        '''INSERT INTO requests (id, title, content, status, created_at, user_id)
+                           VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)''',
+                        ((first_id + n * count,) + row for n, row in enumerate(shard_rows))
+                    )
+                save_progress(conn, source_key, 'requests', rows[-1][0], len(shard_rows))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            last[index] = rows[-1][0]
+            stats['imported'] += len(shard_rows)
+
+        progress.add(len(rows), rows[-1][0])
+    progress.report()
+    stats['rate'] = progress.rate()
+    return stats
+
+
+def drop_request_indexes(conn):
+    for name, _ in REQUEST_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+    conn.commit()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.source):
+        sys.exit(f'Файл не найден: {args.source}')
+    source_key = args.source_name or os.path.abspath(args.source)
+
+    os.environ['DATABASE'] = args.database
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import MainServer as server
+
+    server.init_db()
+    server.close_pools()
+
+    source = open_connection(args.source, read_only=True)
+    tables = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    if not {'users', 'requests'} <= tables:
+        sys.exit('В источнике нет таблиц users и requests')
+
+    # Большой кэш страниц ускоряет вставку в индексы
+    targets = [open_connection(shard_path(args.database, index), server.app.config['DB_TIMEOUT'],
+                               cache_size_kb=64 * 1024)
+               for index in range(server.app.config['SHARD_COUNT'])]
+    try:
+        users = import_users(server, source, targets[0], source_key, args)
+        if args.defer_indexes:
+            for conn in targets:
+                drop_request_indexes(conn)
+        requests = import_requests(server, source, targets, source_key, args)
+
+        # Индексы восстанавливаются и после прерванного запуска с --defer-indexes
+        for conn in targets:
+            create_request_indexes(conn)
+            conn.commit()
+            conn.execute('ANALYZE')
+            conn.commit()
+    finally:
+        for conn in targets:
+            conn.close()
+        source.close()
+
+    print(f'Пользователи: импортировано {users["imported"]}, объединено {users["merged"]}, '
+          f'переименовано {users["renamed"]}, пропущено {users["skipped"]} ({users["rate"]:.0f} строк/с)')
+    print(f'Заявки: импортировано {requests["imported"]}, пропущено {requests["skipped"]} '
+          f'({requests["rate"]:.0f} строк/с)')
+
+
+if __name__ == '__main__':
+    main()
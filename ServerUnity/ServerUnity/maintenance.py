@@ -0,0 +1,200 @@
+"""
+Обслуживание файлов SQLite: контрольные точки WAL и онлайн-снимки.
+
+В режиме WAL коммиты дописываются в файл -wal, а в основной файл их
+переносит контрольная точка (checkpoint). Автоматическая контрольная
+точка SQLite выполняется при коммите и не продвигается дальше снимков,
+которые держат читатели, поэтому под нагрузкой WAL растет, а с ним
+и время чтения. WalMaintenance по расписанию выполняет PASSIVE
+(не ждет ни читателей, ни писателей), а в тихие периоды, когда записей
+давно не было, — TRUNCATE: WAL переносится целиком и файл обрезается.
+
+Снимок (snapshot) копирует живую базу через backup API sqlite3
+во временный файл и переименовывает его, когда копия готова.
+"""
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from db_pool import open_connection
+
+
+def wal_size(path):
+    """Размер файла -wal в байтах (0, если его нет)"""
+    try:
+        return os.path.getsize(path + '-wal')
+    except OSError:
+        return 0
+
+
+def snapshot(path, directory, timeout=30):
+    """
+    Онлайн-снимок базы в directory/<имя>-<время UTC><расширение>.
+    backup выполняется за один шаг: в режиме WAL это одна транзакция
+    чтения, поэтому писатели не ждут, а копия согласована.
+    Снимок — самостоятельный файл в режиме журнала DELETE.
+    Возвращает путь к снимку
+    """
+    os.makedirs(directory, exist_ok=True)
+    base, ext = os.path.splitext(os.path.basename(path))
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    target = os.path.join(directory, f'{base}-{stamp}{ext}')
+    suffix = 1
+    while os.path.exists(target):
+        target = os.path.join(directory, f'{base}-{stamp}-{suffix}{ext}')
+        suffix += 1
+
+    partial = target + '.partial'
+    source = open_connection(path, timeout, read_only=True)
+    dest = sqlite3.connect(partial)
+    try:
+        source.backup(dest)
+        dest.execute('PRAGMA journal_mode=DELETE')
+        dest.close()
+        os.replace(partial, target)
+    except BaseException:
+        dest.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        source.close()
+    return target
+
+
+def list_snapshots(path, directory):
+    """Снимки базы path в directory, от старых к новым"""
+    base, ext = os.path.splitext(os.path.basename(path))
+    paths = glob.glob(os.path.join(glob.escape(directory), f'{glob.escape(base)}-*{ext}'))
+    return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def prune_snapshots(path, directory, keep):
+    """Удаляет старые снимки, оставляя keep последних"""
+    removed = []
+    for old in list_snapshots(path, directory)[:-keep] if keep > 0 else []:
+        os.remove(old)
+        removed.append(old)
+    return removed
+
+
+class WalMaintenance:
+    """
+    Фоновый поток контрольных точек для файлов базы (основного и шардов).
+    PASSIVE выполняется каждые interval секунд, TRUNCATE — если записей
+    не было quiet_after секунд. О записях этого процесса сообщает touch(),
+    записи других процессов (воркеры, импорт) видны по PRAGMA data_version
+    служебных соединений. Служебные соединения получают короткий
+    busy_timeout: TRUNCATE в тихий период не должен надолго задерживать
+    писателя, который все-таки пришел.
+    Если задан snapshot_interval, тот же поток делает снимки run_snapshot();
+    checkpoints=False оставляет только снимки
+    """
+
+    def __init__(self, paths, interval=30, quiet_after=60, busy_timeout=1, checkpoints=True,
+                 snapshot_interval=0, run_snapshot=None, on_checkpoint=None, on_error=None):
+        self.paths = list(paths)
+        self.checkpoints = checkpoints
+        self.interval = interval
+        self.quiet_after = quiet_after
+        self.busy_timeout = busy_timeout
+        self.snapshot_interval = snapshot_interval
+        self._run_snapshot = run_snapshot
+        self._on_checkpoint = on_checkpoint
+        self._on_error = on_error
+        self._conns = {}
+        self._data_versions = {}
+        self._state = {}
+        self._lock = threading.Lock()
+        self._last_write = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def touch(self):
+        """Отметка о записи в базу (вызывается после каждого коммита писателя)"""
+        self._last_write = time.monotonic()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='wal-maintenance', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._lock:
+            for conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
+            # data_version сравнима только в пределах одного соединения
+            self._data_versions.clear()
+
+    def _connection(self, path):
+        # Вызывается под self._lock
+        conn = self._conns.get(path)
+        if conn is None:
+            conn = self._conns[path] = open_connection(path, self.busy_timeout)
+        return conn
+
+    def detect_writes(self):
+        """
+        touch(), если с прошлой проверки файл изменило другое соединение:
+        data_version соединения меняется при каждом чужом коммите
+        """
+        with self._lock:
+            for path in self.paths:
+                version = self._connection(path).execute('PRAGMA data_version').fetchone()[0]
+                if self._data_versions.setdefault(path, version) != version:
+                    self._data_versions[path] = version
+                    self.touch()
+
+    def checkpoint(self, path, mode='PASSIVE'):
+        """PRAGMA wal_checkpoint(mode) для файла; возвращает (busy, кадров в WAL, перенесено)"""
+        with self._lock:
+            busy, log, done = self._connection(path).execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+
+            now = time.time()
+            state = self._state.setdefault(path, {'complete_at': now})
+            state.update(busy=busy, log=log, checkpointed=done)
+            complete = not busy and log == done
+            if complete:
+                state['complete_at'] = now
+        if self._on_checkpoint is not None:
+            self._on_checkpoint(mode, 'busy' if busy else 'complete' if complete else 'partial')
+        return busy, log, done
+
+    def run_once(self):
+        """Контрольные точки всех файлов; TRUNCATE, если записей давно не было"""
+        self.detect_writes()
+        quiet = time.monotonic() - self._last_write >= self.quiet_after
+        for path in self.paths:
+            if quiet and wal_size(path) == 0:
+                continue
+            self.checkpoint(path, 'TRUNCATE' if quiet else 'PASSIVE')
+
+    def lag(self):
+        """Кадров WAL, еще не перенесенных в основной файл, по итогам последней контрольной точки"""
+        return {path: max(0, state['log'] - state['checkpointed']) for path, state in list(self._state.items())}
+
+    def age(self):
+        """Секунд с последней контрольной точки, перенесшей весь WAL"""
+        now = time.time()
+        return {path: now - state['complete_at'] for path, state in list(self._state.items())}
+
+    def _run(self):
+        last_snapshot = time.monotonic()
+        while not self._stop.wait(self.interval):
+            try:
+                if self.checkpoints:
+                    self.run_once()
+                if self.snapshot_interval and time.monotonic() - last_snapshot >= self.snapshot_interval:
+                    last_snapshot = time.monotonic()
+                    self._run_snapshot()
+            except Exception as e:
+                if self._on_error is not None:
+                    self._on_error(e)
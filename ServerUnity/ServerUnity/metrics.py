@@ -0,0 +1,239 @@
+"""
+Метрики сервера в текстовом формате Prometheus.
+
+Время запроса раскладывается на составляющие (SQLite, bcrypt,
+сериализация JSON) через счетчики в thread-local: обработчик их
+накапливает, а хуки запроса сбрасывают и записывают в гистограммы.
+"""
+import bisect
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+TIMING_KINDS = ('db', 'bcrypt', 'serialize', 'compress')
+
+
+class Histogram:
+    """Кумулятивная гистограмма с фиксированными корзинами"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Хранилище метрик процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def gauge(self, name, fn, help_text=''):
+        """Регистрирует показатель, значение которого вычисляется при выдаче /metrics"""
+        self.describe(name, 'gauge', help_text)
+        self._gauges[name] = fn
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            histograms = [(key, list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()]
+            counters = list(self._counters.items())
+
+        lines = []
+        described = set()
+
+        def header(name, default_kind):
+            if name in described:
+                return
+            described.add(name)
+            kind, help_text = self._meta.get(name, (default_kind, ''))
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(counters):
+            header(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        for (name, labels), counts, total, count, buckets in sorted(histograms, key=lambda h: h[0]):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", repr(float(bound))),))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        for name, fn in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            header(name, 'gauge')
+            if isinstance(value, dict):
+                for labels, item in sorted(value.items()):
+                    lines.append(f'{name}{_format_labels(labels)} {item}')
+            else:
+                lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+registry = Registry()
+registry.describe('http_requests_total', 'counter', 'Число обработанных HTTP-запросов')
+registry.describe('http_request_duration_seconds', 'histogram', 'Полное время обработки запроса')
+registry.describe('http_request_db_seconds', 'histogram', 'Время запроса внутри SQLite')
+registry.describe('http_request_bcrypt_seconds', 'histogram', 'Время запроса в bcrypt (с ожиданием пула)')
+registry.describe('http_request_serialize_seconds', 'histogram', 'Время сериализации JSON')
+registry.describe('http_request_compress_seconds', 'histogram', 'Время сжатия ответа')
+registry.describe('sqlite_locked_errors_total', 'counter', 'Ошибки "database is locked"')
+registry.describe('write_queue_batches_total', 'counter', 'Транзакций, зафиксированных потоком-писателем')
+registry.describe('write_queue_operations_total', 'counter', 'Операций записи, выполненных потоком-писателем')
+registry.describe('archived_requests_total', 'counter', 'Заявок, перенесенных в архив')
+registry.describe('wal_checkpoints_total', 'counter', 'Контрольных точек WAL (mode — режим, result — complete, partial или busy)')
+registry.describe('db_snapshots_total', 'counter', 'Онлайн-снимков базы')
+registry.describe('rate_limited_total', 'counter', 'Запросов, отклоненных лимитами (rate — частота, concurrency — параллельность)')
+
+_timings = threading.local()
+
+
+def reset_timings():
+    """Обнуляет накопленное время текущего потока (начало запроса)"""
+    for kind in TIMING_KINDS:
+        setattr(_timings, kind, 0.0)
+
+
+def get_timings():
+    return {kind: getattr(_timings, kind, 0.0) for kind in TIMING_KINDS}
+
+
+def add_timing(kind, seconds):
+    setattr(_timings, kind, getattr(_timings, kind, 0.0) + seconds)
+
+
+@contextmanager
+def timer(kind):
+    """with timer('bcrypt'): ... — добавляет время блока к текущему запросу"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(kind, time.perf_counter() - started)
+
+
+def _count_locked(error):
+    if 'locked' in str(error):
+        registry.inc('sqlite_locked_errors_total')
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, учитывающий время выполнения и выборки как время SQLite"""
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            _count_locked(e)
+            raise
+        finally:
+            add_timing('db', time.perf_counter() - started)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            _count_locked(e)
+            raise
+        finally:
+            add_timing('db', time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_timing('db', time.perf_counter() - started)
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            add_timing('db', time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_timing('db', time.perf_counter() - started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, все курсоры которого — TimedCursor"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute в CPython не вызывает переопределенный cursor(),
+    # поэтому направляем его через TimedCursor явно
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        except sqlite3.OperationalError as e:
+            _count_locked(e)
+            raise
+        finally:
+            add_timing('db', time.perf_counter() - started)
@@ -0,0 +1,379 @@
+"""
+Версионированные миграции схемы.
+Номер примененной миграции хранится в PRAGMA user_version, поэтому
+повторный запуск ничего не делает. Новые изменения схемы добавляются
+в конец списка MIGRATIONS.
+"""
+
+# Колонки строки заявки, общие для requests и requests_archive
+# (перенос в архив и между шардами копирует строку целиком)
+REQUEST_ROW_COLUMNS = 'id, title, content, status, created_at, user_id, version'
+
+# Таблицы основной базы: пользователи живут только в ней (шард 0),
+# в файлах остальных шардов их нет
+PRIMARY_ONLY_TABLES = ('users', 'import_user_map')
+
+
+def _initial_schema(conn):
+    """Таблицы users и requests"""
+    # Таблица пользователей
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_partner INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+
+    # Таблица заявок
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        status TEXT DEFAULT 'new',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        user_id INTEGER REFERENCES users(id)
+    )
+    ''')
+
+
+# Вторичные индексы requests: (имя, определение). Массовый импорт может
+# удалить их на время загрузки и построить заново (create_request_indexes)
+REQUEST_INDEXES = [
+    ('idx_requests_user_created', 'requests(user_id, created_at)'),
+    ('idx_requests_status_created', 'requests(status, created_at)'),
+    ('idx_requests_created', 'requests(created_at)'),
+]
+
+
+def create_request_indexes(conn):
+    for name, definition in REQUEST_INDEXES:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+def _request_indexes(conn):
+    """Индексы под выборки по пользователю, статусу и общий список"""
+    create_request_indexes(conn)
+
+
+# Сколько последних изменений хранит лента
+CHANGES_RETENTION = 100000
+
+
+def _change_feed(conn):
+    """Лента изменений заявок, заполняемая триггерами"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS request_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        request_id INTEGER NOT NULL,
+        user_id INTEGER,
+        op TEXT NOT NULL,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_request_changes_request ON request_changes(request_id, seq)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_request_changes_user ON request_changes(user_id, seq)')
+
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_changes_insert AFTER INSERT ON requests
+    BEGIN
+        INSERT INTO request_changes (request_id, user_id, op) VALUES (NEW.id, NEW.user_id, 'insert');
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_changes_update AFTER UPDATE ON requests
+    BEGIN
+        INSERT INTO request_changes (request_id, user_id, op) VALUES (NEW.id, NEW.user_id, 'update');
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_changes_delete AFTER DELETE ON requests
+    BEGIN
+        INSERT INTO request_changes (request_id, user_id, op) VALUES (OLD.id, OLD.user_id, 'delete');
+    END
+    ''')
+    # Старые записи удаляются по первичному ключу — лента не растет бесконечно
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_request_changes_retention AFTER INSERT ON request_changes
+    BEGIN
+        DELETE FROM request_changes WHERE seq <= NEW.seq - {CHANGES_RETENTION};
+    END
+    ''')
+
+
+def _column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_info({table})'))
+
+
+def _versions(conn):
+    """Версия строки заявки и счетчики версий списков для ETag"""
+    if not _column_exists(conn, 'requests', 'version'):
+        conn.execute('ALTER TABLE requests ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+    # scope: 'all' — общий список, 'user:<id>' — заявки пользователя
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS list_versions (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+
+    bump = '''
+        INSERT INTO list_versions (scope, version) VALUES ({scope}, 1)
+        ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+    '''
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_lists_insert AFTER INSERT ON requests
+    BEGIN
+        {bump.format(scope="'all'")}
+        {bump.format(scope="'user:' || COALESCE(NEW.user_id, '')")}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_lists_update AFTER UPDATE ON requests
+    BEGIN
+        {bump.format(scope="'all'")}
+        {bump.format(scope="'user:' || COALESCE(NEW.user_id, '')")}
+        INSERT INTO list_versions (scope, version)
+        SELECT 'user:' || COALESCE(OLD.user_id, ''), 1 WHERE OLD.user_id IS NOT NEW.user_id
+        ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_lists_delete AFTER DELETE ON requests
+    BEGIN
+        {bump.format(scope="'all'")}
+        {bump.format(scope="'user:' || COALESCE(OLD.user_id, '')")}
+    END
+    ''')
+
+
+def _full_text_search(conn):
+    """Полнотекстовый индекс FTS5 по title и content, синхронизируемый триггерами"""
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts USING fts5(
+        title, content,
+        content='requests', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_fts_insert AFTER INSERT ON requests
+    BEGIN
+        INSERT INTO requests_fts (rowid, title, content) VALUES (NEW.id, NEW.title, NEW.content);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_fts_delete AFTER DELETE ON requests
+    BEGIN
+        INSERT INTO requests_fts (requests_fts, rowid, title, content) VALUES ('delete', OLD.id, OLD.title, OLD.content);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_fts_update AFTER UPDATE OF title, content ON requests
+    BEGIN
+        INSERT INTO requests_fts (requests_fts, rowid, title, content) VALUES ('delete', OLD.id, OLD.title, OLD.content);
+        INSERT INTO requests_fts (rowid, title, content) VALUES (NEW.id, NEW.title, NEW.content);
+    END
+    ''')
+    # Индексация уже существующих заявок
+    conn.execute("INSERT INTO requests_fts (requests_fts) VALUES ('rebuild')")
+
+
+def _archive(conn):
+    """Архив завершенных заявок; перенос в архив отмечается в ленте как 'archive'"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS requests_archive (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        status TEXT,
+        created_at TIMESTAMP,
+        user_id INTEGER,
+        version INTEGER NOT NULL DEFAULT 1,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_requests_archive_user_created ON requests_archive(user_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_requests_archive_status_created ON requests_archive(status, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_requests_archive_created ON requests_archive(created_at)')
+
+    # Строка, уже скопированная в архив, не удалена, а перенесена
+    conn.execute('DROP TRIGGER IF EXISTS trg_requests_changes_delete')
+    conn.execute('''
+    CREATE TRIGGER trg_requests_changes_delete AFTER DELETE ON requests
+    BEGIN
+        INSERT INTO request_changes (request_id, user_id, op) VALUES (
+            OLD.id, OLD.user_id,
+            CASE WHEN EXISTS (SELECT 1 FROM requests_archive WHERE id = OLD.id) THEN 'archive' ELSE 'delete' END
+        );
+    END
+    ''')
+
+
+def _settings(conn):
+    """Служебные настройки базы (например, число шардов, по которому разложены заявки)"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS server_settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    ) WITHOUT ROWID
+    ''')
+
+
+def _import_state(conn):
+    """Прогресс импорта из старых баз и соответствие старых id пользователей новым"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS import_progress (
+        source TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        last_id INTEGER NOT NULL,
+        rows INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (source, stage)
+    ) WITHOUT ROWID
+    ''')
+    # new_id NULL — пользователь пропущен, его заявки не импортируются
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS import_user_map (
+        source TEXT NOT NULL,
+        old_id INTEGER NOT NULL,
+        new_id INTEGER,
+        PRIMARY KEY (source, old_id)
+    ) WITHOUT ROWID
+    ''')
+
+
+def _request_stats(conn):
+    """
+    Число заявок по статусам (scope 'all' и 'user:<id>', как в list_versions):
+    count — в рабочей таблице, archived — в архиве. Ведется триггерами
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS request_stats (
+        scope TEXT NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        archived INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (scope, status)
+    ) WITHOUT ROWID
+    ''')
+
+    def change(column, row, delta):
+        status = f"COALESCE({row}.status, '')"
+        return ''.join(f'''
+        INSERT INTO request_stats (scope, status, {column}) VALUES ({scope}, {status}, {delta})
+        ON CONFLICT(scope, status) DO UPDATE SET {column} = {column} + {delta};'''
+            for scope in ("'all'", f"'user:' || COALESCE({row}.user_id, '')"))
+
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_stats_insert AFTER INSERT ON requests
+    BEGIN{change('count', 'NEW', 1)}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_stats_update AFTER UPDATE OF status, user_id ON requests
+    WHEN OLD.status IS NOT NEW.status OR OLD.user_id IS NOT NEW.user_id
+    BEGIN{change('count', 'OLD', -1)}{change('count', 'NEW', 1)}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_stats_delete AFTER DELETE ON requests
+    BEGIN{change('count', 'OLD', -1)}
+    END
+    ''')
+    # Перенос в архив: удаление из requests уменьшает count, вставка в архив увеличивает archived
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_archive_stats_insert AFTER INSERT ON requests_archive
+    BEGIN{change('archived', 'NEW', 1)}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_requests_archive_stats_delete AFTER DELETE ON requests_archive
+    BEGIN{change('archived', 'OLD', -1)}
+    END
+    ''')
+
+    # Счетчики для уже существующих заявок
+    conn.execute('DELETE FROM request_stats')
+    for table, column in (('requests', 'count'), ('requests_archive', 'archived')):
+        for scope in ("'all'", "'user:' || COALESCE(user_id, '')"):
+            conn.execute(f'''
+            INSERT INTO request_stats (scope, status, {column})
+            SELECT {scope}, COALESCE(status, ''), COUNT(*) FROM {table} WHERE true GROUP BY 1, 2
+            ON CONFLICT(scope, status) DO UPDATE SET {column} = excluded.{column}
+            ''')
+
+
+# (версия, описание, функция применения)
+MIGRATIONS = [
+    (1, 'users и requests', _initial_schema),
+    (2, 'индексы requests', _request_indexes),
+    (3, 'лента изменений заявок', _change_feed),
+    (4, 'версии заявок и списков', _versions),
+    (5, 'полнотекстовый поиск заявок', _full_text_search),
+    (6, 'архив завершенных заявок', _archive),
+    (7, 'служебные настройки', _settings),
+    (8, 'состояние импорта', _import_state),
+    (9, 'счетчики заявок по статусам', _request_stats),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """Текущая версия схемы базы"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, primary=True):
+    """
+    Применяет недостающие миграции, каждую в своей транзакции.
+    BEGIN IMMEDIATE берет блокировку записи, поэтому несколько процессов,
+    стартующих одновременно, применят каждую миграцию ровно один раз;
+    читатели в режиме WAL при этом не блокируются.
+    primary=False — файл шарда: миграции те же, но пустые таблицы
+    PRIMARY_ONLY_TABLES после них удаляются.
+    Возвращает список примененных версий.
+    """
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Другой процесс мог успеть применить миграцию, пока мы ждали блокировку
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+
+    if not primary:
+        _drop_primary_only_tables(conn)
+
+    if applied:
+        # Статистика для планировщика запросов после изменения индексов
+        conn.execute('ANALYZE')
+        conn.commit()
+    return applied
+
+
+def _drop_primary_only_tables(conn):
+    """Удаляет из файла шарда таблицы основной базы, если они пусты"""
+    for table in PRIMARY_ONLY_TABLES:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if exists and conn.execute(f'SELECT NOT EXISTS (SELECT 1 FROM {table})').fetchone()[0]:
+            conn.execute(f'DROP TABLE {table}')
+    conn.commit()
@@ -0,0 +1,133 @@
+"""
+Ограничение частоты запросов (token bucket) и отсечение лишней нагрузки.
+
+Корзина ключа (IP, имя пользователя) вмещает burst жетонов и пополняется
+со скоростью rate жетонов в секунду; запрос тратит один жетон.
+Состояние корзин хранит backend:
+    MemoryBackend — в памяти процесса (у каждого воркера свое);
+    SQLiteBackend — в отдельном файле SQLite, общем для всех воркеров.
+"""
+import sqlite3
+import threading
+import time
+
+from caches import TTLCache
+
+
+class MemoryBackend:
+    """Корзины в памяти процесса; давно не пополнявшиеся вытесняются"""
+
+    def __init__(self, maxsize=100000):
+        # Полная корзина не отличается от отсутствующей — запись живет, пока не наполнится
+        self._buckets = TTLCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Тратит жетон. Возвращает (разрешено, через сколько секунд повторить)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets.set(key, (tokens, now), ttl=(burst - tokens) / rate)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class SQLiteBackend:
+    """
+    Корзины в отдельной базе SQLite: лимиты общие для всех процессов-воркеров.
+    Проверка и списание — один атомарный UPSERT, без явной транзакции.
+    Файл отдельный, чтобы не конкурировать за блокировку записи users.db
+    """
+
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._hits = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Состояние лимитов не критично при сбое питания
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                expires REAL NOT NULL
+            ) WITHOUT ROWID
+            ''')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst):
+        """Тратит жетон. Возвращает (разрешено, через сколько секунд повторить)"""
+        conn = self._connection()
+        now = time.time()
+        params = {'key': key, 'now': now, 'rate': rate, 'burst': burst, 'expires': now + burst / rate}
+        allowed = conn.execute('''
+            INSERT INTO rate_buckets (key, tokens, updated, expires) VALUES (:key, :burst - 1, :now, :expires)
+            ON CONFLICT(key) DO UPDATE SET
+                tokens = MIN(:burst, tokens + (:now - updated) * :rate) - 1,
+                updated = :now,
+                expires = :expires
+            WHERE MIN(:burst, tokens + (:now - updated) * :rate) >= 1
+        ''', params).rowcount > 0
+
+        self._hits += 1
+        if self._hits % self.CLEANUP_EVERY == 0:
+            conn.execute('DELETE FROM rate_buckets WHERE expires < ?', (now,))
+
+        if allowed:
+            return True, 0
+        row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+        tokens = min(burst, row[0] + (now - row[1]) * rate) if row else 0
+        return False, max(0, (1 - tokens) / rate)
+
+
+class TokenBucket:
+    """Лимит rate запросов в секунду с запасом burst на один ключ"""
+
+    def __init__(self, backend, rate, burst, prefix=''):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+
+    def hit(self, key):
+        """(разрешено, retry_after в секундах)"""
+        return self.backend.take(self.prefix + key, self.rate, self.burst)
+
+
+class ConcurrencyLimit:
+    """Не более limit одновременных запросов; лишние отклоняются сразу, без ожидания"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._active = 0
+
+    def try_acquire(self):
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._active += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    @property
+    def active(self):
+        return self._active
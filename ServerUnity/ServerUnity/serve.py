@@ -0,0 +1,101 @@
+"""
+Production-запуск: несколько процессов-воркеров под gunicorn (pre-fork).
+
+Мастер-процесс один раз загружает приложение и выполняет init_db()
+(миграции) до fork, после чего закрывает свои соединения с базой.
+Каждый воркер после fork открывает собственные пулы и прогревает их
+(warm_up); кэши пользователей и токенов у воркеров свои.
+
+Сигналы мастеру (стандартные для gunicorn):
+    HUP  — плавный перезапуск воркеров с перечитыванием настроек
+    USR2 — запуск нового мастера с новым кодом (затем TERM старому)
+    TERM — плавная остановка: воркеры дописывают очередь записи
+
+Пример:
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+
+Нужен gunicorn (pip install gunicorn); на Windows он недоступен —
+там используйте python MainServer.py.
+"""
+import argparse
+import os
+import sys
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Многопроцессный запуск сервера заявок')
+    parser.add_argument('--bind', default=os.environ.get('BIND', '0.0.0.0:5000'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', os.cpu_count() or 2)),
+                        help='число процессов-воркеров')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', 8)),
+                        help='потоков на воркер (long-poll и SSE занимают поток)')
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('WEB_TIMEOUT', 60)),
+                        help='воркер, не отвечающий мастеру столько секунд, перезапускается')
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30)))
+    parser.add_argument('--max-requests', type=int, default=int(os.environ.get('WEB_MAX_REQUESTS', 0)),
+                        help='перезапуск воркера после N запросов (0 — без ограничения)')
+    return parser.parse_args(argv)
+
+
+def load_app():
+    """Загрузка приложения в мастере: миграции ровно один раз, до fork"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import MainServer
+
+    MainServer.init_db()
+    MainServer.close_pools()
+    return MainServer.app
+
+
+def post_fork(server, worker):
+    """Прогрев воркера: свои соединения вместо унаследованных"""
+    import MainServer
+
+    try:
+        MainServer.warm_up()
+    except Exception as e:
+        # Без прогрева воркер все равно работает — пулы откроются по первому запросу
+        worker.log.warning('Прогрев воркера не удался: %s', e)
+
+
+def worker_exit(server, worker):
+    """Перед выходом воркер останавливает архивацию и дописывает очереди записи"""
+    import MainServer
+
+    MainServer.shutdown(timeout=server.cfg.graceful_timeout)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit('Нужен gunicorn: pip install gunicorn (на Windows используйте python MainServer.py)')
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': args.bind,
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': 'gthread',
+                'timeout': args.timeout,
+                'graceful_timeout': args.graceful_timeout,
+                'max_requests': args.max_requests,
+                'max_requests_jitter': args.max_requests // 10,
+                # Приложение загружается в мастере — init_db выполняется один раз
+                'preload_app': True,
+                'post_fork': post_fork,
+                'worker_exit': worker_exit,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app()
+
+    Application().run()
+
+
+if __name__ == '__main__':
+    main()
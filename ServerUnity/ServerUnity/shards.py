@@ -0,0 +1,124 @@
+"""
+Шардирование заявок по нескольким файлам SQLite.
+
+SQLite допускает одного писателя на файл, поэтому при SHARD_COUNT > 1
+заявки распределяются по файлам по владельцу: шард = user_id % N.
+Шард 0 — основная база (в ней же таблица users), остальные —
+users.shard1.db, users.shard2.db ... рядом с ней. Схема у всех шардов
+одинаковая (те же миграции), только таблиц пользователей в файлах
+шардов нет (migrate(primary=False)). У каждого шарда свои пулы и поток-писатель,
+а триггеры ведут ленту изменений, версии списков и поиск внутри шарда.
+
+ID новой заявки сравним с номером шарда по модулю N, поэтому заявка
+по id находится без перебора. Заявки, созданные до включения
+шардирования или смены N, rebalance() переносит в шард владельца
+с прежними id — их находит перебор шардов.
+"""
+import heapq
+import itertools
+import json
+import os
+
+from migrations import REQUEST_ROW_COLUMNS
+
+_ROW_PLACEHOLDERS = ', '.join('?' for _ in REQUEST_ROW_COLUMNS.split(','))
+
+
+def shard_path(path, index):
+    """Файл шарда: 0 — сама основная база"""
+    if index == 0:
+        return path
+    base, ext = os.path.splitext(path)
+    return f'{base}.shard{index}{ext or ".db"}'
+
+
+def shard_of(user_id, count):
+    """Шард владельца; заявки без владельца живут в основной базе"""
+    return user_id % count if user_id is not None else 0
+
+
+def request_sequence(conn):
+    """Наибольший выданный в файле id заявки (sqlite_sequence)"""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'requests'").fetchone()
+    return row[0] if row else 0
+
+
+def next_request_id(conn, index, count):
+    """Следующий id заявки шарда: больше всех выданных и сравним с index по модулю count"""
+    candidate = request_sequence(conn) + 1
+    return candidate + (index - candidate) % count
+
+
+def merge_rows(row_iterables, limit=None):
+    """
+    Слияние выборок шардов, каждая упорядочена по (created_at, id) DESC
+    (первые две колонки строки — id и created_at). Возвращает итератор
+    """
+    merged = heapq.merge(*row_iterables, key=lambda row: (row[1] or '', row[0]), reverse=True)
+    return itertools.islice(merged, limit) if limit else merged
+
+
+def encode_position(seqs):
+    """Позиция в лентах изменений всех шардов: 'seq0.seq1...'"""
+    return '.'.join(str(seq) for seq in seqs)
+
+
+def decode_position(value, count):
+    """Разбор позиции 'seq0.seq1...'; ValueError, если она не для count шардов"""
+    seqs = [int(part) for part in str(value).split('.')]
+    if len(seqs) != count:
+        raise ValueError('Позиция ленты не соответствует числу шардов')
+    return seqs
+
+
+def later_position(a, b):
+    """Поэлементный максимум двух позиций"""
+    count = len(str(a).split('.'))
+    return encode_position(max(x, y) for x, y in zip(decode_position(a, count), decode_position(b, count)))
+
+
+def rebalance(conns, count, batch_size=1000):
+    """
+    Переносит заявки (и архив) в шард владельца после смены числа шардов.
+    conns — соединения со всеми файлами, включая шарды сверх count, которые
+    освобождаются целиком. Строка сначала копируется (INSERT OR IGNORE),
+    затем удаляется из источника, поэтому прерванный перенос можно повторить.
+    Возвращает число перенесенных строк
+    """
+    moved = 0
+    for source_index, source in enumerate(conns):
+        for table in ('requests', 'requests_archive'):
+            while True:
+                rows = source.execute(
+                    f'SELECT {REQUEST_ROW_COLUMNS} FROM {table} WHERE ? >= ? OR COALESCE(user_id, 0) % ? != ? LIMIT ?',
+                    (source_index, count, count, source_index, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+
+                by_target = {}
+                for row in rows:
+                    by_target.setdefault(shard_of(row[5], count), []).append(row)
+                for target_index, target_rows in by_target.items():
+                    target = conns[target_index]
+                    target.executemany(
+                        f'INSERT OR IGNORE INTO {table} ({REQUEST_ROW_COLUMNS}) VALUES ({_ROW_PLACEHOLDERS})',
+                        target_rows
+                    )
+                    target.commit()
+
+                source.execute(
+                    f'DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))',
+                    (json.dumps([row[0] for row in rows]),)
+                )
+                source.commit()
+                moved += len(rows)
+
+    # Новые id всех шардов должны быть больше любого перенесенного
+    top = max(request_sequence(conn) for conn in conns)
+    for conn in conns[:count]:
+        if request_sequence(conn) < top:
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'requests'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('requests', ?)", (top,))
+            conn.commit()
+    return moved
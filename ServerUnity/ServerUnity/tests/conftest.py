@@ -0,0 +1,75 @@
+"""
+Общая настройка тестов сервера.
+
+MainServer читает конфигурацию из окружения при импорте, поэтому
+окружение (временная база, маленькие пулы, быстрый bcrypt) задается
+здесь, до импорта модулей сервера. Запуск из ServerUnity/ServerUnity:
+    python -m pytest -q tests
+"""
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix='serverunity-tests-')
+os.environ.update({
+    'DATABASE': os.path.join(_tmp, 'users.db'),
+    'SNAPSHOT_DIR': os.path.join(_tmp, 'snapshots'),
+    'DB_READ_POOL_SIZE': '4',
+    'DB_TIMEOUT': '2',
+    'BCRYPT_ROUNDS': '4',
+    'ARCHIVE_ENABLED': '0',
+    'WAL_CHECKPOINT_ENABLED': '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import MainServer as server
+
+
+@pytest.fixture(scope='session')
+def app():
+    server.init_db()
+    yield server.app
+    server.shutdown(timeout=5)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+_user_numbers = itertools.count(1)
+
+
+@pytest.fixture
+def make_user(app, client):
+    """make_user(admin=False) -> (id, заголовки с токеном) нового пользователя"""
+    def make(admin=False):
+        number = next(_user_numbers)
+        username = f'user{number}'
+        # Свой адрес у каждого пользователя — тесты не упираются в лимит входа по IP
+        environ = {'REMOTE_ADDR': f'192.168.{number // 250}.{number % 250 + 1}'}
+        client.post('/api/register', json={'username': username, 'email': f'{username}@example.com',
+                                           'password': 'secret123'}, environ_base=environ)
+        with sqlite3.connect(app.config['DATABASE']) as conn:
+            if admin:
+                conn.execute('UPDATE users SET is_partner = 1 WHERE username = ?', (username,))
+            user_id = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()[0]
+        server.invalidate_user(username)
+        token = client.post('/api/login', json={'username': username, 'password': 'secret123'},
+                            environ_base=environ).get_json()['token']
+        return user_id, {'Authorization': f'Bearer {token}'}
+    return make
+
+
+@pytest.fixture
+def create_request(client):
+    """create_request(headers, title=...) -> id новой заявки"""
+    def create(headers, title='title', content='content'):
+        response = client.post('/api/requests', json={'title': title, 'content': content}, headers=headers)
+        assert response.status_code == 201
+        return response.get_json()['request']['id']
+    return create
@@ -0,0 +1,44 @@
+import sqlite3
+
+import MainServer as server
+
+
+def archive(app, request_id):
+    """Состаривает заявку и запускает пачку архивации"""
+    with sqlite3.connect(server.shard_path(app.config['DATABASE'], server.request_shard(request_id))) as conn:
+        conn.execute("UPDATE requests SET created_at = datetime('now', '-365 days') WHERE id = ?", (request_id,))
+    assert server._archive_next_batch() >= 1
+
+
+def test_archived_request_is_served_and_read_only(app, client, make_user, create_request):
+    _, owner = make_user()
+    _, admin = make_user(admin=True)
+    request_id = create_request(owner, title='finished')
+    kept_id = create_request(owner, title='open')
+    assert client.patch(f'/api/requestsAdminAccept/{request_id}', json={'status': 'Completed'},
+                        headers=admin).status_code == 200
+    archive(app, request_id)
+
+    # Заявка ушла из рабочей таблицы, но читается из архива
+    response = client.get(f'/api/requests/{request_id}', headers=owner)
+    assert response.status_code == 200
+    assert response.get_json()['request']['status'] == 'Completed'
+
+    listed = [item['id'] for item in client.get('/api/request', headers=owner).get_json()['requests']]
+    assert kept_id in listed and request_id not in listed
+    listed = [item['id'] for item in
+              client.get('/api/request?include_archived=1', headers=owner).get_json()['requests']]
+    assert request_id in listed
+
+    # Изменения архивной заявки явно отклоняются, а не теряются
+    update = client.put(f'/api/requests/{request_id}', json={'title': 'new', 'content': 'new'}, headers=owner)
+    assert update.status_code == 409
+    assert client.delete(f'/api/requests/{request_id}', headers=owner).status_code == 409
+    assert client.delete(f'/api/requestsAdmin/{request_id}', headers=admin).status_code == 409
+    assert client.get(f'/api/requests/{request_id}', headers=owner).get_json()['request']['title'] == 'finished'
+
+
+def test_missing_request_update_is_not_found(client, make_user):
+    _, owner = make_user()
+    response = client.put('/api/requests/987654', json={'title': 'x', 'content': 'y'}, headers=owner)
+    assert response.status_code == 404
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import MainServer as server
+from asgi import ASGIApplication
+
+
+async def call(application, path, query=b''):
+    """GET через ASGI-приложение; возвращает (статус, тело)"""
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'headers': []}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    status = next(m['status'] for m in messages if m['type'] == 'http.response.start')
+    body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+    return status, body
+
+
+def test_streamed_responses_return_read_connections(app, client):
+    client.post('/api/register', json={'username': 'streamer', 'email': 'streamer@example.com',
+                                       'password': 'secret123'})
+    token = client.post('/api/login', json={'username': 'streamer', 'password': 'secret123'}).get_json()['token']
+    for i in range(20):
+        client.post('/api/requests', json={'title': f'title {i}', 'content': 'content'},
+                    headers={'Authorization': f'Bearer {token}'})
+
+    size = app.config['DB_READ_POOL_SIZE']
+    application = ASGIApplication(server)
+
+    async def run():
+        # Больше потоковых ответов, чем соединений в пуле чтения
+        for _ in range(size * 3):
+            status, body = await call(application, '/api/requests', b'stream=ndjson')
+            assert status == 200
+            assert len(body.splitlines()) >= 20
+        status, _ = await call(application, '/api/requests')
+        assert status == 200
+
+    try:
+        asyncio.run(run())
+    finally:
+        application.executor.shutdown(wait=True)
+        application.db_executor.shutdown(wait=True)
+
+    # Все соединения вернулись в пул: каждый из size потоков получает свое
+    pool = server.get_read_pool()
+    barrier = threading.Barrier(size)
+
+    def hold():
+        conn = pool.acquire()
+        try:
+            barrier.wait(timeout=5)
+        finally:
+            pool.release(conn)
+
+    with ThreadPoolExecutor(size) as executor:
+        for future in [executor.submit(hold) for _ in range(size)]:
+            future.result()
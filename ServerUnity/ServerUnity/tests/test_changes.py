@@ -0,0 +1,20 @@
+def test_malformed_request_id_is_rejected(client, make_user):
+    _, headers = make_user()
+    response = client.get('/api/changes?request_id=abc&since=0&timeout=0', headers=headers)
+    assert response.status_code == 400
+
+
+def test_request_filter_is_scoped_to_owner(client, make_user, create_request):
+    _, owner = make_user()
+    _, other = make_user()
+    _, admin = make_user(admin=True)
+    request_id = create_request(owner)
+
+    def changes(headers):
+        response = client.get(f'/api/changes?request_id={request_id}&since=0&timeout=0', headers=headers)
+        assert response.status_code == 200
+        return response.get_json()['changes']
+
+    assert [change['request_id'] for change in changes(owner)] == [request_id]
+    assert changes(other) == []
+    assert [change['request_id'] for change in changes(admin)] == [request_id]
@@ -0,0 +1,38 @@
+import gzip
+import json
+
+import MainServer as server
+
+
+def test_large_listing_is_gzipped(client, make_user, create_request):
+    _, owner = make_user()
+    for number in range(5):
+        create_request(owner, title=f'заявка {number}', content='x' * server.app.config['COMPRESSION_MIN_SIZE'])
+
+    plain = client.get('/api/request', headers=owner)
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    response = client.get('/api/request', headers={**owner, 'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(response.get_data()) < len(plain.get_data())
+    assert json.loads(gzip.decompress(response.get_data())) == plain.get_json()
+
+    # 304 и маленькие ответы не сжимаются
+    etag = response.headers['ETag']
+    cached = client.get('/api/request', headers={**owner, 'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert cached.status_code == 304 and 'Content-Encoding' not in cached.headers
+    small = client.get('/api/request?limit=1&fields=id', headers={**owner, 'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+
+def test_streamed_listing_is_gzipped(client, make_user, create_request):
+    _, owner = make_user()
+    ids = [create_request(owner, title=f'заявка {number}') for number in range(3)]
+
+    response = client.get('/api/requests?stream=ndjson', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+    streamed = [json.loads(line)['id'] for line in lines]
+    assert [request_id for request_id in streamed if request_id in ids] == sorted(ids, reverse=True)
@@ -0,0 +1,36 @@
+def test_request_etag_and_not_modified(client, make_user, create_request):
+    _, owner = make_user()
+    request_id = create_request(owner)
+
+    first = client.get(f'/api/requests/{request_id}', headers=owner)
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and etag
+    cached = client.get(f'/api/requests/{request_id}', headers={**owner, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.get_data() == b''
+
+    client.put(f'/api/requests/{request_id}', json={'title': 'new', 'content': 'new'}, headers=owner)
+    changed = client.get(f'/api/requests/{request_id}', headers={**owner, 'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['request']['title'] == 'new'
+
+
+def test_list_etag_follows_writes_and_query(client, make_user, create_request):
+    _, owner = make_user()
+    create_request(owner)
+
+    etag = client.get('/api/request', headers=owner).headers['ETag']
+    assert client.get('/api/request', headers={**owner, 'If-None-Match': etag}).status_code == 304
+    # Другие параметры — другой ответ, другой ETag
+    assert client.get('/api/request?limit=1', headers={**owner, 'If-None-Match': etag}).status_code == 200
+
+    # Запись другого пользователя не сбрасывает чужой список
+    _, other = make_user()
+    create_request(other)
+    assert client.get('/api/request', headers={**owner, 'If-None-Match': etag}).status_code == 304
+
+    create_request(owner)
+    response = client.get('/api/request', headers={**owner, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()['requests']) == 2
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+import importer
+
+
+class Interrupted(Exception):
+    pass
+
+
+def make_source(path):
+    """База старой схемы: 3 пользователя, 5 заявок"""
+    with sqlite3.connect(path) as conn:
+        conn.executescript('''
+            CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+                                email TEXT UNIQUE NOT NULL, password TEXT NOT NULL,
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE requests (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, content TEXT NOT NULL,
+                                   status TEXT DEFAULT 'new', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                   user_id INTEGER REFERENCES users(id));
+        ''')
+        conn.executemany('INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
+                         [(f'legacy{n}', f'legacy{n}@example.com', 'hash') for n in range(3)])
+        conn.executemany('INSERT INTO requests (title, content, user_id) VALUES (?, ?, ?)',
+                         [(f'legacy request {n}', 'content', n % 3 + 1) for n in range(5)])
+
+
+def imported(database):
+    with sqlite3.connect(database) as conn:
+        users = conn.execute("SELECT id, username FROM users WHERE username LIKE 'legacy%'").fetchall()
+        requests = conn.execute(
+            "SELECT title, user_id FROM requests WHERE title LIKE 'legacy request %' ORDER BY title"
+        ).fetchall()
+    return dict(users), requests
+
+
+def test_interrupted_import_resumes_without_duplicates(app, tmp_path, monkeypatch):
+    source = str(tmp_path / 'old.db')
+    make_source(source)
+    database = app.config['DATABASE']
+    monkeypatch.setenv('DATABASE', database)
+    argv = [source, '--database', database, '--batch-size', '2', '--report-interval', '3600']
+
+    # Обрыв после первой зафиксированной пачки заявок
+    add = importer.Progress.add
+
+    def interrupt(progress, rows, last_id):
+        add(progress, rows, last_id)
+        if progress.stage == 'requests':
+            raise Interrupted()
+    monkeypatch.setattr(importer.Progress, 'add', interrupt)
+    with pytest.raises(Interrupted):
+        importer.main(argv)
+    users, requests = imported(database)
+    assert len(users) == 3 and len(requests) == 2
+
+    monkeypatch.setattr(importer.Progress, 'add', add)
+    importer.main(argv)
+    users, requests = imported(database)
+    ids = {name: user_id for user_id, name in users.items()}
+    assert requests == [(f'legacy request {n}', ids[f'legacy{n % 3}']) for n in range(5)]
+
+    # Повторный полный запуск ничего не добавляет
+    importer.main(argv)
+    assert imported(database) == (users, requests)
@@ -0,0 +1,50 @@
+import os
+import sqlite3
+import time
+
+import MainServer as server
+from maintenance import WalMaintenance
+
+
+def test_snapshot_response_has_no_server_paths(app, client, make_user):
+    _, admin = make_user(admin=True)
+    response = client.post('/api/admin/snapshot', headers=admin)
+    assert response.status_code == 201
+    snapshots = response.get_json()['snapshots']
+    assert snapshots
+    for item in snapshots:
+        assert set(item) == {'name', 'size', 'created_at'}
+        assert os.path.basename(item['name']) == item['name']
+        path = os.path.join(app.config['SNAPSHOT_DIR'], item['name'])
+        assert os.path.getsize(path) == item['size']
+        with sqlite3.connect(path) as conn:
+            assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+
+
+def test_user_writes_mark_database_dirty(app, make_user):
+    before = server.wal_maintenance._last_write
+    make_user()
+    assert server.wal_maintenance._last_write > before
+
+
+def test_writes_of_other_processes_delay_truncate(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute('PRAGMA journal_mode=WAL')
+    writer.execute('CREATE TABLE t (x)')
+    modes = []
+    maintenance = WalMaintenance([path], quiet_after=0.2, on_checkpoint=lambda mode, result: modes.append(mode))
+    try:
+        maintenance.run_once()
+        time.sleep(0.3)
+        # Чужое соединение о себе не сообщает (touch не вызывается), но запись видна по data_version
+        writer.execute('INSERT INTO t VALUES (1)')
+        maintenance.run_once()
+        assert modes[-1] == 'PASSIVE'
+
+        time.sleep(0.3)
+        maintenance.run_once()
+        assert modes[-1] == 'TRUNCATE'
+    finally:
+        maintenance.stop()
+        writer.close()
@@ -0,0 +1,29 @@
+def test_pages_cover_listing_without_overlap(client, make_user, create_request):
+    _, owner = make_user()
+    created = [create_request(owner, title=f'title {number}') for number in range(7)]
+
+    seen = []
+    after = None
+    while True:
+        url = '/api/request?limit=3&fields=id,title' + (f'&after={after}' if after else '')
+        body = client.get(url, headers=owner).get_json()
+        assert all(set(item) == {'id', 'title'} for item in body['requests'])
+        assert len(body['requests']) <= 3
+        seen.extend(item['id'] for item in body['requests'])
+        after = body['next_cursor']
+        if after is None:
+            break
+
+    # Новые сверху, каждая заявка ровно один раз; созданы в одну секунду — порядок держит id
+    assert seen == sorted(created, reverse=True)
+    full = client.get('/api/request', headers=owner).get_json()
+    assert 'next_cursor' not in full
+    assert [item['id'] for item in full['requests']] == seen
+
+
+def test_invalid_list_arguments(client, make_user):
+    _, owner = make_user()
+    for query in ('limit=0', 'limit=abc', 'after=not-a-cursor', 'fields=password'):
+        response = client.get(f'/api/request?{query}', headers=owner)
+        assert response.status_code == 400, query
+        assert response.get_json()['success'] is False
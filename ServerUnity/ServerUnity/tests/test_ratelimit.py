@@ -0,0 +1,36 @@
+import pytest
+
+
+@pytest.mark.parametrize('encoding', ['json', 'form'])
+def test_login_is_limited_per_username(app, client, encoding):
+    username = f'victim-{encoding}'
+    burst = int(app.config['RATE_LIMIT_USER_BURST'])
+
+    def attempt(n):
+        body = {'username': username, 'password': f'guess{n}'}
+        # Каждая попытка с нового адреса — срабатывает только лимит по имени
+        environ = {'REMOTE_ADDR': f'10.0.{n // 250}.{n % 250 + 1}'}
+        if encoding == 'json':
+            return client.post('/api/login', json=body, environ_base=environ)
+        return client.post('/api/login', data=body, environ_base=environ)
+
+    statuses = [attempt(n).status_code for n in range(burst + 1)]
+    assert 429 not in statuses[:burst]
+    assert statuses[burst] == 429
+
+
+def test_forged_forwarded_for_does_not_bypass_ip_limit(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_PROXY_HOPS', 1)
+    burst = int(app.config['RATE_LIMIT_IP_BURST'])
+
+    def attempt(n, real='203.0.113.7'):
+        # Клиент меняет левую запись, доверенный прокси дописывает его настоящий адрес
+        headers = {'X-Forwarded-For': f'198.51.100.{n % 250 + 1}, {real}'}
+        return client.post('/api/login', json={'username': f'nobody{n}', 'password': 'guess'},
+                           headers=headers, environ_base={'REMOTE_ADDR': '10.255.0.1'})
+
+    statuses = [attempt(n).status_code for n in range(burst + 1)]
+    assert 429 not in statuses[:burst]
+    assert statuses[burst] == 429
+    # Другой клиент за тем же прокси ограничен отдельно
+    assert attempt(burst + 1, real='203.0.113.8').status_code != 429
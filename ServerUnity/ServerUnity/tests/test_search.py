@@ -0,0 +1,40 @@
+import MainServer as server
+
+
+def search(client, headers, q, **params):
+    response = client.get('/api/requests/search', query_string={'q': q, **params}, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_index_follows_request_writes(client, make_user, create_request):
+    _, owner = make_user()
+    request_id = create_request(owner, title='Broken zephyrpump', content='leaks near the valve')
+    create_request(owner, title='unrelated', content='nothing here')
+
+    # Префикс последнего слова, поиск и по title, и по content
+    assert [item['id'] for item in search(client, owner, 'zephyrp')['requests']] == [request_id]
+    found = search(client, owner, 'zephyrpump valve')['requests']
+    assert [item['id'] for item in found] == [request_id]
+    assert found[0]['title'] == f'Broken {server.SEARCH_HIGHLIGHT_OPEN}zephyrpump{server.SEARCH_HIGHLIGHT_CLOSE}'
+
+    client.put(f'/api/requests/{request_id}', json={'title': 'Fixed quixoticfan', 'content': 'ok'}, headers=owner)
+    assert search(client, owner, 'zephyrpump')['requests'] == []
+    assert [item['id'] for item in search(client, owner, 'quixoticfan')['requests']] == [request_id]
+
+    client.delete(f'/api/requests/{request_id}', headers=owner)
+    assert search(client, owner, 'quixoticfan')['requests'] == []
+
+
+def test_pages_and_user_syntax(client, make_user, create_request):
+    _, owner = make_user()
+    for number in range(3):
+        create_request(owner, title=f'xylograph {number}')
+    first = search(client, owner, 'xylograph', limit=2)
+    assert len(first['requests']) == 2 and first['next_offset'] == 2
+    rest = search(client, owner, 'xylograph', limit=2, offset=2)
+    assert len(rest['requests']) == 1 and rest['next_offset'] is None
+
+    # Операторы FTS5 из ввода считаются обычным текстом
+    assert search(client, owner, 'xylograph" OR NEAR(*')['requests'] == []
+    assert client.get('/api/requests/search?q=%22*', headers=owner).status_code == 400
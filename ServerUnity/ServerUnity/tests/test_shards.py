@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+from archive import archive_batch
+from db_pool import open_connection
+from migrations import PRIMARY_ONLY_TABLES, migrate
+from shards import next_request_id, rebalance, request_sequence, shard_of, shard_path
+
+
+@pytest.fixture
+def files(tmp_path):
+    """Открыватель файлов шардов во временном каталоге с примененными миграциями"""
+    opened = []
+
+    def open_shards(count):
+        conns = []
+        for index in range(count):
+            conn = open_connection(shard_path(str(tmp_path / 'users.db'), index))
+            migrate(conn, primary=index == 0)
+            conns.append(conn)
+        opened.extend(conns)
+        return conns
+
+    yield open_shards
+    for conn in opened:
+        conn.close()
+
+
+def locations(conns):
+    """id заявки -> [(шард, таблица, user_id)] по всем файлам"""
+    found = {}
+    for index, conn in enumerate(conns):
+        for table in ('requests', 'requests_archive'):
+            for request_id, user_id in conn.execute(f'SELECT id, user_id FROM {table}'):
+                found.setdefault(request_id, []).append((index, table, user_id))
+    return found
+
+
+def test_rebalance_moves_every_request_to_its_owner_shard(files):
+    single = files(1)[0]
+    single.executemany(
+        'INSERT INTO requests (title, content, status, user_id) VALUES (?, ?, ?, ?)',
+        [(f'title {i}', 'content', 'Completed' if i % 4 == 0 else 'new', i % 7 or None) for i in range(200)]
+    )
+    single.execute("UPDATE requests SET created_at = datetime('now', '-1 day') WHERE status = 'Completed'")
+    single.commit()
+    archive_batch(single, ['Completed'], 0, 20)
+    single.commit()
+    before = {request_id: places[0][1:] for request_id, places in locations([single]).items()}
+    assert any(table == 'requests_archive' for table, _ in before.values())
+
+    conns = files(3)
+    assert rebalance(conns, 3, batch_size=17) > 0
+
+    # Каждая заявка ровно в одном месте: в шарде владельца и в той же таблице
+    after = locations(conns)
+    assert set(after) == set(before)
+    for request_id, places in after.items():
+        assert len(places) == 1
+        index, table, user_id = places[0]
+        assert (table, user_id) == before[request_id]
+        assert index == shard_of(user_id, 3)
+
+    # Новые id больше перенесенных и сравнимы с номером шарда
+    top = max(before)
+    for index, conn in enumerate(conns):
+        assert request_sequence(conn) >= top
+        new_id = next_request_id(conn, index, 3)
+        assert new_id > top and new_id % 3 == index
+
+    # Обратно в один файл: ничего не теряется
+    assert rebalance(conns, 1) > 0
+    back = locations(conns[:1])
+    assert {request_id: places[0][1:] for request_id, places in back.items()} == before
+    assert all(not locations([conn]) for conn in conns[1:])
+
+
+def test_shard_files_have_no_user_tables(files):
+    conns = files(2)
+    tables = [{row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+              for conn in conns]
+    assert set(PRIMARY_ONLY_TABLES) <= tables[0]
+    assert not set(PRIMARY_ONLY_TABLES) & tables[1]
+    # Заявка в шарде вставляется без таблицы users
+    conns[1].execute("INSERT INTO requests (title, content, user_id) VALUES ('t', 'c', 1)")
+    conns[1].commit()
@@ -0,0 +1,55 @@
+import sqlite3
+
+import MainServer as server
+from test_archive import archive
+
+
+def counted(app, user_id, table):
+    """Прямой подсчет по таблице — с ним сверяются счетчики триггеров"""
+    path = server.shard_path(app.config['DATABASE'], server.user_shard(user_id))
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute(f'SELECT status, COUNT(*) FROM {table} WHERE user_id = ? GROUP BY status',
+                                 (user_id,)))
+
+
+def stats(client, headers, archived=False):
+    response = client.get('/api/requests/stats' + ('?include_archived=1' if archived else ''), headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_counters_follow_writes_and_archive(app, client, make_user, create_request):
+    user_id, owner = make_user()
+    _, admin = make_user(admin=True)
+
+    def check():
+        live = counted(app, user_id, 'requests')
+        total = dict(live)
+        for status, count in counted(app, user_id, 'requests_archive').items():
+            total[status] = total.get(status, 0) + count
+        assert stats(client, owner)['by_status'] == live
+        body = stats(client, owner, archived=True)
+        assert body['by_status'] == total and body['total'] == sum(total.values())
+
+    ids = [create_request(owner) for _ in range(4)]
+    check()
+    client.patch(f'/api/requestsAdminAccept/{ids[0]}', json={'status': 'Completed'}, headers=admin)
+    client.patch(f'/api/requestsAdminAccept/{ids[1]}', json={'status': 'Completed'}, headers=admin)
+    check()
+    client.delete(f'/api/requests/{ids[2]}', headers=owner)
+    check()
+    archive(app, ids[0])
+    check()
+    assert stats(client, owner)['by_status'].get('Completed') == 1
+    assert stats(client, owner, archived=True)['by_status']['Completed'] == 2
+
+
+def test_stats_scope(client, make_user):
+    user_id, owner = make_user()
+    other_id, _ = make_user()
+    _, admin = make_user(admin=True)
+    assert stats(client, owner)['scope'] == f'user:{user_id}'
+    assert client.get(f'/api/requests/stats?user_id={other_id}', headers=owner).status_code == 403
+    assert client.get(f'/api/requests/stats?user_id={other_id}', headers=admin).get_json()['scope'] == f'user:{other_id}'
+    assert stats(client, admin)['scope'] == 'all'
+    assert client.get('/api/requests/stats?user_id=x', headers=admin).status_code == 400
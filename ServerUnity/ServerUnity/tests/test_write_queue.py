@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+
+import pytest
+
+from write_queue import WriteQueue
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE items (name TEXT UNIQUE)')
+    return path
+
+
+def names(path):
+    with sqlite3.connect(path) as conn:
+        return sorted(row[0] for row in conn.execute('SELECT name FROM items'))
+
+
+def insert(conn, name):
+    return conn.execute('INSERT INTO items (name) VALUES (?)', (name,)).lastrowid
+
+
+def test_failing_operation_rolls_back_only_itself(db):
+    release = threading.Event()
+    queue = WriteQueue(lambda: sqlite3.connect(db, check_same_thread=False), max_batch=10, max_delay=0.2)
+
+    def blocked(conn):
+        release.wait(5)
+
+    try:
+        # Первая операция держит писателя, пока очередь не наберет пачку
+        first = queue.submit(blocked)
+        futures = [queue.submit(insert, name) for name in ('a', 'a', 'b')]
+        release.set()
+        first.result(5)
+        assert futures[0].result(5) and futures[2].result(5)
+        with pytest.raises(sqlite3.IntegrityError):
+            futures[1].result(5)
+    finally:
+        queue.stop(5)
+    assert names(db) == ['a', 'b']
+
+
+def test_timed_out_operation_is_not_committed(db):
+    release = threading.Event()
+    queue = WriteQueue(lambda: sqlite3.connect(db, check_same_thread=False), max_batch=1)
+    try:
+        slow = queue.submit(lambda conn: release.wait(5))
+        with pytest.raises(sqlite3.OperationalError):
+            queue.execute(insert, 'late', timeout=0.1)
+        release.set()
+        slow.result(5)
+        queue.execute(insert, 'next', timeout=5)
+    finally:
+        queue.stop(5)
+    assert names(db) == ['next']
+
+
+def test_stop_drains_queued_operations(db):
+    release = threading.Event()
+    queue = WriteQueue(lambda: sqlite3.connect(db, check_same_thread=False), max_batch=1)
+    queue.submit(lambda conn: release.wait(5))
+    futures = [queue.submit(insert, f'item{i}') for i in range(5)]
+    release.set()
+    queue.stop(5)
+    assert all(future.done() and future.exception() is None for future in futures)
+    assert names(db) == [f'item{i}' for i in range(5)]
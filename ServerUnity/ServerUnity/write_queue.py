@@ -0,0 +1,180 @@
+"""
+Очередь записи с групповым коммитом.
+
+SQLite допускает одного писателя на файл, поэтому вместо того, чтобы
+потоки Flask по очереди брали блокировку записи, мутации выполняет
+один поток-писатель со своим соединением. Обработчик ставит функцию
+в очередь и ждет результат; писатель собирает пачку (до max_batch
+операций или max_delay секунд ожидания) и выполняет ее в одной
+транзакции — один коммит на пачку вместо коммита на запрос.
+
+Все записи работающего сервера (заявки, пользователи, архивация) идут
+через писателя своего файла. Напрямую пишут только миграции и перенос
+между шардами при старте — до того, как сервер принимает запросы, —
+и импорт (importer.py), который выполняется отдельным процессом
+большими транзакциями; писатель сервера в это время ждет busy_timeout.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Поток-писатель с пакетной фиксацией.
+
+    connect() вызывается в потоке писателя и возвращает соединение для
+    записи. Каждая операция выполняется внутри SAVEPOINT: ошибка одной
+    операции откатывает только ее, остальные операции пачки фиксируются.
+    on_commit() вызывается после каждого успешного коммита.
+    """
+
+    def __init__(self, connect, max_batch=64, max_delay=0.002, lock_retries=3, on_commit=None):
+        self._connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.lock_retries = lock_retries
+        self._on_commit = on_commit
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Поток запускается при первой записи — после fork у каждого процесса свой писатель
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args):
+        """Ставит fn(conn, *args) в очередь; возвращает Future с результатом fn"""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((future, fn, args))
+        return future
+
+    def execute(self, fn, *args, timeout=None):
+        """
+        Выполняет fn(conn, *args) в потоке писателя и ждет фиксации.
+        По таймауту операция снимается с очереди; если писатель уже начал
+        ее, ждем результата — иначе клиент получил бы ошибку, а запись
+        все равно была бы зафиксирована
+        """
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise sqlite3.OperationalError('Очередь записи не ответила вовремя')
+            return future.result()
+
+    def pending(self):
+        """Число операций, ожидающих писателя"""
+        return self._queue.qsize()
+
+    def stop(self, timeout=None):
+        """Дописывает очередь и останавливает поток"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _next_batch(self):
+        """Ждет первую операцию и добирает к ней пачку"""
+        item = self._queue.get()
+        if item is _STOP:
+            return None, True
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        conn = None
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if not batch:
+                continue
+            batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self._apply(conn, batch)
+            except Exception as e:
+                # Пачка целиком не зафиксирована — сообщаем об этом всем ее операциям
+                for future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                if conn is not None and not self._is_usable(conn):
+                    conn.close()
+                    conn = None
+        if conn is not None:
+            conn.close()
+
+    def _begin(self, conn):
+        """BEGIN IMMEDIATE с повторами, если блокировку держит другой процесс дольше busy_timeout"""
+        for attempt in range(self.lock_retries + 1):
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or attempt == self.lock_retries:
+                    raise
+                time.sleep(0.01 * (attempt + 1))
+
+    def _apply(self, conn, batch):
+        if conn.in_transaction:
+            conn.rollback()
+        self._begin(conn)
+        results = []
+        try:
+            for future, fn, args in batch:
+                conn.execute('SAVEPOINT write_op')
+                try:
+                    result = fn(conn, *args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_op')
+                    conn.execute('RELEASE write_op')
+                    results.append((future, None, e))
+                else:
+                    conn.execute('RELEASE write_op')
+                    results.append((future, result, None))
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+        if self._on_commit is not None:
+            self._on_commit(len(batch))
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _is_usable(conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False